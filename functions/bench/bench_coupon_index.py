@@ -0,0 +1,178 @@
+"""CouponIndex のベンチマークと、日付による絞り込みとの一致確認
+
+ランダムに生成したクーポンで、索引から引いた有効なクーポンが、
+毎回 pd.to_datetime して日付で絞り込んだ結果と一致することを確認してから、速度を比較する。
+有効期間の開始・終了ちょうどの日時も確認する。
+また、今日有効な全品対象のクーポンが1件もない日に、main の取得から
+新しい商品名の決定までが失敗しないことを、疑似RMSサーバーで確認する。
+割引の値（discountFactor）のないクーポンを含むレスポンスから索引を作れることと、
+クーポン数がページの件数で割り切れない時に、最後のページまで取得することも確認する。
+
+    python functions/bench/bench_coupon_index.py [試行回数]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from bench_coupon_selection import TODAY, random_coupons
+from fake_rms import EXPIRED_END, FakeRms, make_coupon, start_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from coupon_index import SHOP_WIDE, CouponIndex  # noqa: E402
+from coupon_parser import parse_coupon_response  # noqa: E402
+
+
+def random_index_case(rng: np.random.Generator, item_count: int) -> pd.DataFrame:
+    frames = [random_coupons(rng, int(rng.integers(0, 10)), SHOP_WIDE)]
+    for number in range(item_count):
+        manage_number = f"item-{number}"
+        frames.append(
+            random_coupons(rng, int(rng.integers(0, 4)), manage_number).assign(
+                **{"item.manageNumber": manage_number}
+            )
+        )
+    return pd.concat(frames, ignore_index=True).fillna({"item.manageNumber": ""})
+
+
+def filter_by_date(coupon_df: pd.DataFrame, manage_number: str, when) -> set:
+    """改修前と同じく、その都度日付を変換して絞り込む"""
+    target = coupon_df[coupon_df["item.manageNumber"].isin([manage_number, SHOP_WIDE])]
+    start = pd.to_datetime(target["start_date"], utc=True)
+    end = pd.to_datetime(target["end_date"], utc=True)
+    when = pd.Timestamp(when)
+    return set(target.loc[(start < when) & (end > when), "coupon_code"])
+
+
+def check_equivalence(trials: int):
+    rng = np.random.default_rng(0)
+    for trial in range(trials):
+        item_count = int(rng.integers(1, 10))
+        coupon_df = random_index_case(rng, item_count)
+        index = CouponIndex(coupon_df)
+        boundaries = list(pd.to_datetime(coupon_df["start_date"])) + list(
+            pd.to_datetime(coupon_df["end_date"])
+        )
+        times = [TODAY + timedelta(hours=int(h)) for h in rng.integers(-300, 300, 5)]
+        times += [b for b in boundaries[:5]]
+        for when in times:
+            valid = set(index.valid_at(when)["coupon_code"])
+            expected = set()
+            for number in range(item_count):
+                manage_number = f"item-{number}"
+                found = index.lookup(manage_number, when)
+                expected_item = filter_by_date(coupon_df, manage_number, when)
+                assert set(found["coupon_code"]) == expected_item, (trial, when)
+                expected |= expected_item
+            expected |= filter_by_date(coupon_df, SHOP_WIDE, when)
+            assert valid == expected, (trial, when)
+    print(f"{trials} random cases match the date filter")
+
+
+def import_main(base_url: str, work_dir: str):
+    """疑似RMSサーバーと作業ディレクトリを使う設定で、main を読み込む
+
+    2回目以降は読み込み済みの main を使うため、接続先とキャッシュの保存先を差し替える
+    """
+    cache_path = os.path.join(work_dir, "coupon_cache.sqlite3")
+    os.environ.update(
+        SERVICE_SECRETS="dummy",
+        LISCENSE_KEY="dummy",
+        RMS_BASE_URL=base_url,
+        RMS_MAX_RPS="1000",
+        COUPON_CACHE_PATH=cache_path,
+    )
+    import main
+
+    main.rms.base_url = base_url
+    main.COUPON_CACHE_PATH = cache_path
+    return main
+
+
+def check_no_valid_shop_wide():
+    """期限切れの全品対象クーポンしかない日も、全品対象のクーポンは空で処理を続ける"""
+    fake = FakeRms(item_count=10, coupon_count=0)
+    expired = {**make_coupon(0, fake.item_count), "couponEndDate": EXPIRED_END}
+    fake.coupons = [expired]
+    fake.coupons_by_code = {expired["couponCode"]: expired}
+    server, base_url = start_server(fake)
+    with tempfile.TemporaryDirectory() as work_dir:
+        main = import_main(base_url, work_dir)
+        common_coupons = main.get_common_coupon()
+        df_items = main.prefix_df(main.get_item_list())
+        df_new_name = main.get_coupon_by_item(df_items, CouponIndex(common_coupons))
+    server.shutdown()
+    assert len(common_coupons) == 0
+    assert len(CouponIndex(common_coupons).valid_at(datetime.now())) == 0
+    assert df_new_name["new_name"].notna().all()
+    print("no valid shop-wide coupon: titles are decided without shop-wide coupons")
+
+
+def check_uneven_coupon_pages():
+    """最後のページが端数の時も、全品対象のクーポンをすべて取得する"""
+    fake = FakeRms(item_count=10, coupon_count=250)
+    expected = {
+        coupon["couponCode"]
+        for coupon in fake.coupons
+        if coupon["itemType"] == "4" and coupon["couponEndDate"] != EXPIRED_END
+    }
+    server, base_url = start_server(fake)
+    with tempfile.TemporaryDirectory() as work_dir:
+        common_coupons = import_main(base_url, work_dir).get_common_coupon()
+    server.shutdown()
+    assert set(common_coupons["coupon_code"]) == expected
+    print(f"250 coupons: all {len(expected)} shop-wide coupons are fetched")
+
+
+def check_missing_discount():
+    """discountFactor のないクーポンは、割引の値を0として索引に入れる"""
+    fake = FakeRms(item_count=1, coupon_count=0)
+    fake.add_coupon({**make_coupon(1, 1), "discountType": "4", "discountFactor": None})
+    fake.add_coupon(make_coupon(3, 1))
+    content = fake.search_coupons({"itemUrl": ["item-0000000"]})
+    coupon_df = pd.DataFrame(parse_coupon_response(content).coupons)
+    assert coupon_df["discount"].isna().sum() == 1
+    index = CouponIndex(coupon_df.assign(**{"item.manageNumber": "item-0000000"}))
+    found = index.lookup("item-0000000", datetime.now())
+    assert sorted(found["discount"]) == [0, 40]
+    print("missing discountFactor: indexed with a discount of 0")
+
+
+def bench(item_count: int, lookups: int):
+    rng = np.random.default_rng(1)
+    coupon_df = random_index_case(rng, item_count)
+    manage_numbers = [f"item-{n}" for n in rng.integers(0, item_count, lookups)]
+
+    started = time.perf_counter()
+    index = CouponIndex(coupon_df)
+    for manage_number in manage_numbers:
+        index.lookup(manage_number, TODAY)
+    new_elapsed = time.perf_counter() - started
+    print(
+        f"[index ] coupons={len(coupon_df):>6} lookups={lookups:>5} "
+        f"time={new_elapsed:8.3f}s"
+    )
+
+    started = time.perf_counter()
+    for manage_number in manage_numbers:
+        filter_by_date(coupon_df, manage_number, TODAY)
+    old_elapsed = time.perf_counter() - started
+    print(
+        f"[filter] coupons={len(coupon_df):>6} lookups={lookups:>5} "
+        f"time={old_elapsed:8.3f}s"
+    )
+
+
+if __name__ == "__main__":
+    check_equivalence(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
+    check_no_valid_shop_wide()
+    check_uneven_coupon_pages()
+    check_missing_discount()
+    for count in (1_000, 10_000):
+        bench(count, 1_000)
@@ -0,0 +1,54 @@
+"""クーポンAPIのXML解析のベンチマーク
+
+10,000件のクーポンを含むレスポンスを、改修前のElementTreeでの複数回走査と、
+iterparseでの1回走査で解析して比較する。
+
+    python functions/bench/bench_coupon_parser.py [クーポン数]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+
+import legacy
+from fake_rms import FakeRms
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("SERVICE_SECRETS", "dummy")
+os.environ.setdefault("LISCENSE_KEY", "dummy")
+
+import main  # noqa: E402
+
+
+def legacy_parse(content: bytes) -> pd.DataFrame:
+    return legacy.extract_coupon_info(ET.fromstring(content.decode("utf-8")))
+
+
+def measure(func, content: bytes) -> tuple[pd.DataFrame, float, int]:
+    # 時間はtracemallocのオーバーヘッドを含めないよう、別に計測する
+    started = time.perf_counter()
+    result = func(content)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    func(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == "__main__":
+    coupon_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    fake = FakeRms(item_count=1000, coupon_count=coupon_count)
+    content = fake.search_coupons({"hits": [str(coupon_count)]})
+    print(f"response size={len(content) / 1024 / 1024:.1f}MiB coupons={coupon_count}")
+
+    new_df, new_elapsed, new_peak = measure(main.extract_coupon_info, content)
+    old_df, old_elapsed, old_peak = measure(legacy_parse, content)
+    print(f"[new   ] time={new_elapsed:6.3f}s peak={new_peak / 1024 / 1024:6.1f}MiB")
+    print(f"[legacy] time={old_elapsed:6.3f}s peak={old_peak / 1024 / 1024:6.1f}MiB")
+    pd.testing.assert_frame_equal(new_df, old_df)
+    print("results match")
@@ -0,0 +1,167 @@
+"""select_best_coupon のベンチマークと、改修前の処理との一致確認
+
+ランダムに生成した商品とクーポンで、改修前の iterrows による選択と
+結果が一致することを確認してから、速度を比較する。商品を細かく分けて組み合わせを作った時も
+一致することと、全品対象のクーポンが多い時のメモリの使用量も確認する。
+
+    python functions/bench/bench_coupon_selection.py [試行回数]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+import legacy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import coupon_selection  # noqa: E402
+from coupon_selection import select_best_coupon  # noqa: E402
+
+TODAY = datetime(2024, 10, 1, 12, tzinfo=ZoneInfo("Asia/Tokyo"))
+
+
+def random_coupons(rng: np.random.Generator, count: int, prefix: str) -> pd.DataFrame:
+    coupon_type = rng.choice(["1", "2", "3"], size=count)
+    discount = np.where(
+        coupon_type == "1",
+        rng.integers(0, 10, size=count) * 100,
+        rng.integers(0, 11, size=count) * 10,
+    )
+    # 有効期間は今日をまたぐもの、過去のもの、未来のものを混ぜる
+    start = [TODAY + timedelta(days=int(d)) for d in rng.integers(-10, 3, size=count)]
+    end = [
+        s + timedelta(days=int(d))
+        for s, d in zip(start, rng.integers(1, 10, size=count))
+    ]
+    return pd.DataFrame(
+        {
+            "coupon_code": [f"{prefix}-{i}" for i in range(count)],
+            "start_date": [s.isoformat() for s in start],
+            "end_date": [e.isoformat() for e in end],
+            "discount": discount.astype(str),
+            "coupon_type": coupon_type,
+            "condition_value": rng.choice([0, 0, 1000, 3000, 5000], size=count),
+        }
+    )
+
+
+def random_case(rng: np.random.Generator, item_count: int):
+    items = pd.DataFrame(
+        {
+            "item.manageNumber": [f"item-{i}" for i in range(item_count)],
+            "price": rng.integers(1, 60, size=item_count) * 100,
+        }
+    )
+    frames = []
+    for manage_number in items["item.manageNumber"]:
+        coupons = random_coupons(rng, int(rng.integers(0, 6)), manage_number)
+        if len(coupons) == 0:
+            # extract_coupon_by_item と同じく、クーポンがない商品には期限切れの仮の値
+            coupons = pd.DataFrame(
+                {
+                    "coupon_code": [""],
+                    "start_date": ["2024-01-01T00:00:00+09:00"],
+                    "end_date": ["2024-01-01T00:00:00+09:00"],
+                    "discount": [0],
+                    "coupon_type": [1],
+                    "condition_value": [0],
+                }
+            )
+        frames.append(
+            coupons.drop(columns="condition_value").assign(
+                **{"item.manageNumber": manage_number}
+            )
+        )
+    item_coupons = pd.concat(frames, ignore_index=True)
+    common_coupons = random_coupons(rng, int(rng.integers(0, 6)), "common")
+    return items, item_coupons, common_coupons
+
+
+def prepare(coupon_df: pd.DataFrame) -> pd.DataFrame:
+    if "condition_value" not in coupon_df.columns:
+        coupon_df = coupon_df.assign(condition_value=0)
+    return coupon_df.assign(
+        start_date=pd.to_datetime(coupon_df["start_date"]),
+        end_date=pd.to_datetime(coupon_df["end_date"]),
+        discount=coupon_df["discount"].astype("int32"),
+        condition_value=coupon_df["condition_value"].fillna(0).astype("int"),
+    )
+
+
+def legacy_select(items, item_coupons, common_coupons) -> list:
+    results = []
+    for manage_number, price in zip(items["item.manageNumber"], items["price"]):
+        coupon_df = pd.concat(
+            [
+                item_coupons[item_coupons["item.manageNumber"] == manage_number],
+                common_coupons,
+            ]
+        )
+        results.append(legacy.select_coupon(price, coupon_df, TODAY))
+    return results
+
+
+def check_equivalence(trials: int):
+    rng = np.random.default_rng(0)
+    for trial in range(trials):
+        items, item_coupons, common_coupons = random_case(rng, int(rng.integers(1, 20)))
+        new = select_best_coupon(
+            items, prepare(item_coupons), prepare(common_coupons), TODAY
+        )
+        old = legacy_select(items, item_coupons, common_coupons)
+        for position, (discount, discount_type, discount_price) in enumerate(old):
+            actual = tuple(new.iloc[position])
+            assert actual[0] == discount, (trial, position, actual, old[position])
+            assert actual[1] == discount_type, (trial, position, actual, old[position])
+            assert actual[2] == discount_price, (trial, position, actual, old[position])
+    print(f"{trials} random cases match the legacy selection")
+
+
+def bench_memory(item_count: int, common_count: int):
+    """全品対象のクーポンが多い時の、select_best_coupon のピークメモリ"""
+    rng = np.random.default_rng(2)
+    items, item_coupons, _ = random_case(rng, item_count)
+    common_coupons = random_coupons(rng, common_count, "common")
+    item_coupons, common_coupons = prepare(item_coupons), prepare(common_coupons)
+    tracemalloc.start()
+    select_best_coupon(items, item_coupons, common_coupons, TODAY)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"[memory] items={item_count:>6} common={common_count:>5} "
+        f"peak={peak / 2**20:8.1f}MiB"
+    )
+
+
+def bench(item_count: int):
+    rng = np.random.default_rng(1)
+    items, item_coupons, common_coupons = random_case(rng, item_count)
+    started = time.perf_counter()
+    select_best_coupon(items, prepare(item_coupons), prepare(common_coupons), TODAY)
+    new_elapsed = time.perf_counter() - started
+    print(f"[new   ] items={item_count:>6} time={new_elapsed:8.3f}s")
+    if item_count <= 2_000:
+        started = time.perf_counter()
+        legacy_select(items, item_coupons, common_coupons)
+        old_elapsed = time.perf_counter() - started
+        print(f"[legacy] items={item_count:>6} time={old_elapsed:8.3f}s")
+
+
+if __name__ == "__main__":
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    check_equivalence(trials)
+    # 組み合わせを数商品ずつに分けて作っても、結果は変わらない
+    max_pairs = coupon_selection.MAX_PAIRS
+    coupon_selection.MAX_PAIRS = 7
+    check_equivalence(trials)
+    coupon_selection.MAX_PAIRS = max_pairs
+    bench_memory(1_000, 1_714)
+    for count in (1_000, 100_000):
+        bench(count)
@@ -0,0 +1,59 @@
+"""コールドスタート時の main の読み込み時間のベンチマーク
+
+新しいプロセスで `python -X importtime -c "import main"` を繰り返し実行し、
+main の読み込み時間（中央値）と、main が直接読み込むモジュールのうち
+時間の掛かるものを表示する。認証情報などの環境変数は設定しない。
+
+    python functions/bench/bench_import_time.py [繰り返し回数]
+"""
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+# import time:      self [us] | cumulative | imported package
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_times() -> dict:
+    """1回分の、main と main が直接読み込むモジュールの読み込み時間（マイクロ秒）"""
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if key not in ("SERVICE_SECRETS", "LISCENSE_KEY")
+    }
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=SRC_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in completed.stderr.splitlines():
+        matched = LINE.match(line)
+        if matched is None:
+            continue
+        _, cumulative, indent, name = matched.groups()
+        # 名前の前の空白が3文字（字下げ1段）のものは、main が直接読み込んだモジュール
+        if name == "main" or len(indent) == 3:
+            times[name] = int(cumulative)
+    return times
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    runs = [import_times() for _ in range(repeat)]
+    total = statistics.median(run["main"] for run in runs) / 1000
+    print(f"import main: {total:8.1f}ms (median of {repeat})")
+    modules = {name for run in runs for name in run if name != "main"}
+    medians = {
+        name: statistics.median(run.get(name, 0) for run in runs) / 1000
+        for name in modules
+    }
+    for name, elapsed in sorted(medians.items(), key=lambda x: -x[1])[:10]:
+        print(f"  {name:<32} {elapsed:8.1f}ms")
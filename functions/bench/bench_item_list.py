@@ -0,0 +1,61 @@
+"""get_item_list / iter_item_pages のベンチマーク
+
+商品数を変えて、ページごとのメモリ使用量が一定であることを確認する。
+
+    python functions/bench/bench_item_list.py
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+from fake_rms import FakeRms, start_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("SERVICE_SECRETS", "dummy")
+os.environ.setdefault("LISCENSE_KEY", "dummy")
+os.environ.setdefault("RMS_MAX_RPS", "1000")
+
+
+def bench(item_count: int):
+    fake = FakeRms(item_count=item_count)
+    server, base_url = start_server(fake)
+    import main
+
+    main.rms.base_url = base_url
+
+    # ストリーミング：ページを受け取ったら捨てる
+    tracemalloc.start()
+    started = time.perf_counter()
+    pages = 0
+    page_peaks = []
+    for page in main.iter_item_pages():
+        pages += 1
+        _, peak = tracemalloc.get_traced_memory()
+        page_peaks.append(peak)
+        tracemalloc.reset_peak()
+    elapsed = time.perf_counter() - started
+    tracemalloc.stop()
+    print(
+        f"[stream] items={item_count:>6} pages={pages:>4} "
+        f"time={elapsed:6.2f}s max_peak_per_page={max(page_peaks) / 1024:8.1f}KiB"
+    )
+
+    # DataFrame化：最後に1回だけ構築
+    tracemalloc.start()
+    started = time.perf_counter()
+    df = main.get_item_list()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"[frame ] items={len(df):>6} "
+        f"time={elapsed:6.2f}s peak={peak / 1024 / 1024:8.1f}MiB"
+    )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    for count in (1_000, 10_000, 30_000):
+        bench(count)
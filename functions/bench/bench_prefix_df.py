@@ -0,0 +1,40 @@
+"""prefix_df のベンチマーク
+
+改修前の iterrows 実装と、列方向の集計による実装を比較する。
+
+    python functions/bench/bench_prefix_df.py [商品数]
+"""
+
+import os
+import sys
+import time
+
+import pandas as pd
+
+import legacy
+from fake_rms import make_item
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("SERVICE_SECRETS", "dummy")
+os.environ.setdefault("LISCENSE_KEY", "dummy")
+
+import main  # noqa: E402
+
+
+def timed(func, df: pd.DataFrame) -> tuple[pd.DataFrame, float]:
+    started = time.perf_counter()
+    result = func(df)
+    return result, time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    item_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    df_items = pd.json_normalize([make_item(i) for i in range(item_count)])
+
+    new_df, new_elapsed = timed(main.prefix_df, df_items)
+    print(f"[new   ] items={item_count} time={new_elapsed:8.3f}s")
+    old_df, old_elapsed = timed(legacy.prefix_df, df_items)
+    print(f"[legacy] items={item_count} time={old_elapsed:8.3f}s")
+
+    pd.testing.assert_frame_equal(new_df, old_df)
+    print(f"results match, speedup x{old_elapsed / new_elapsed:.0f}")
@@ -0,0 +1,80 @@
+"""RmsClient のレート制限と同時実行数の調整のベンチマーク
+
+1秒あたりの上限を守る疑似サーバーに対して並列にリクエストを送り、
+スループットと429の発生数を確認する。上限どおりに設定したクライアントは429を受けない。同時に処理できる数に上限のある疑似サーバーに対しては、
+503を受けて同時実行数を下げ、全件成功することを確認する。
+
+    python functions/bench/bench_rms_client.py
+"""
+
+import os
+import sys
+import time
+
+from fake_rms import FakeRms, start_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from rms_client import RmsClient  # noqa: E402
+
+
+def bench(quota: float, client_rps: float, max_workers: int, request_count: int):
+    fake = FakeRms(item_count=10, rate_limit=quota)
+    server, base_url = start_server(fake)
+    client = RmsClient(
+        headers={}, base_url=base_url, max_rps=client_rps, max_workers=max_workers
+    )
+
+    def fetch(_):
+        return client.get("/2.0/items/search", params={"hits": 1}).status_code
+
+    started = time.perf_counter()
+    statuses = client.map(fetch, range(request_count))
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+    print(
+        f"quota={quota:>4}/s client={client_rps:>4}/s workers={max_workers:>2} "
+        f"ok={statuses.count(200):>3}/{request_count} time={elapsed:6.2f}s "
+        f"throughput={request_count / elapsed:5.1f}/s 429s={fake.throttled_count}"
+    )
+    assert statuses.count(200) == request_count
+    if client_rps <= quota:
+        assert fake.throttled_count == 0
+
+
+def bench_concurrency(max_concurrency: int, max_workers: int, request_count: int):
+    fake = FakeRms(item_count=10, latency=0.05, max_concurrency=max_concurrency)
+    server, base_url = start_server(fake)
+    client = RmsClient(
+        headers={},
+        base_url=base_url,
+        max_rps=1000,
+        max_workers=max_workers,
+        backoff=0.1,
+    )
+
+    def fetch(_):
+        return client.get("/2.0/items/search", params={"hits": 1}).status_code
+
+    started = time.perf_counter()
+    statuses = client.map(fetch, range(request_count))
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+    print(
+        f"server={max_concurrency:>2} concurrent workers={max_workers:>2} "
+        f"ok={statuses.count(200):>3}/{request_count} time={elapsed:6.2f}s "
+        f"throughput={request_count / elapsed:5.1f}/s 503s={fake.overloaded_count} "
+        f"limit={client.concurrency.limit:.1f} decreases={client.concurrency.decreases}"
+    )
+    assert statuses.count(200) == request_count
+
+
+if __name__ == "__main__":
+    # 上限どおりに設定したクライアントは429を受けない
+    bench(quota=5, client_rps=5, max_workers=8, request_count=50)
+    bench(quota=10, client_rps=10, max_workers=8, request_count=100)
+    # 上限より多く設定しても、429を受けたら待って再試行し、全件成功する
+    bench(quota=5, client_rps=20, max_workers=8, request_count=50)
+    # 同時に処理できる数より多く送っても、503を受けて同時実行数を下げ、全件成功する
+    bench_concurrency(max_concurrency=4, max_workers=4, request_count=200)
+    bench_concurrency(max_concurrency=4, max_workers=16, request_count=200)
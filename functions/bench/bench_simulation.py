@@ -0,0 +1,130 @@
+"""simulation.py の試算のベンチマークと、main の結果との一致確認
+
+疑似RMSサーバーに対して main を1回実行し、保存した商品一覧・クーポンで
+現在の日時を試算した新しい商品名が、main が監査ログに書き出したものと一致することを
+確認する。開始前の全品対象のクーポンも保存され、その期間の日時の試算に使われることも確認する。
+その後、日時やクーポンを変えたシナリオを試算し、1秒あたりのシナリオ数を表示する。
+
+    python functions/bench/bench_simulation.py [商品数] [シナリオ数]
+"""
+
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+from fake_rms import FakeRms, make_coupon, start_server
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from simulation import Simulator, load_snapshot  # noqa: E402
+
+# 明日から始まる全品対象のクーポン（main の実行時点では有効でない）
+UPCOMING_START = datetime.now(tz=ZoneInfo("Asia/Tokyo")) + timedelta(days=1)
+UPCOMING_COUPON = {
+    **make_coupon(0, 1),
+    "couponCode": "UPCOMING",
+    "couponStartDate": UPCOMING_START.isoformat(timespec="seconds"),
+    "couponEndDate": (UPCOMING_START + timedelta(days=2)).isoformat(timespec="seconds"),
+    "discountType": "2",
+    "discountFactor": "50",
+    "conditions": [],
+}
+
+
+def run_main(item_count: int, work_dir: str):
+    """main を1回実行し、試算用のスナップショットと監査ログを work_dir に保存する"""
+    fake = FakeRms(item_count=item_count, coupon_count=item_count // 5)
+    fake.add_coupon(UPCOMING_COUPON)
+    server, base_url = start_server(fake)
+    env = {
+        **os.environ,
+        "SERVICE_SECRETS": "dummy",
+        "LISCENSE_KEY": "dummy",
+        "RMS_BASE_URL": base_url,
+        "RMS_MAX_RPS": "1000",
+        "RMS_MAX_WORKERS": "8",
+        "COUPON_CACHE_PATH": os.path.join(work_dir, "coupon_cache.sqlite3"),
+        "CHECKPOINT_DIR": os.path.join(work_dir, "checkpoint"),
+        "AUDIT_TABLE": "",
+        "AUDIT_LOCAL_DIR": os.path.join(work_dir, "audit"),
+        "METRICS_TABLE": "",
+        "SIMULATION_SNAPSHOT_DIR": os.path.join(work_dir, "snapshot"),
+    }
+    subprocess.run(
+        [sys.executable, os.path.join(BENCH_DIR, "run_main.py")],
+        env=env,
+        capture_output=True,
+        check=True,
+    )
+    server.shutdown()
+
+
+def random_scenarios(rng: np.random.Generator, count: int) -> list:
+    """日時をずらしたシナリオと、全品対象のクーポンを追加したシナリオ"""
+    now = datetime.now(tz=ZoneInfo("Asia/Tokyo"))
+    scenarios = []
+    for number in range(count):
+        at = now + timedelta(hours=int(rng.integers(-48, 48)))
+        scenario = {"name": f"scenario-{number}", "at": at.isoformat()}
+        if number % 2 == 1:
+            scenario["add_coupons"] = [
+                {
+                    "coupon_code": f"what-if-{number}",
+                    "start_date": (at - timedelta(days=1)).isoformat(),
+                    "end_date": (at + timedelta(days=1)).isoformat(),
+                    "discount": int(rng.integers(1, 10)) * 10,
+                    "coupon_type": "2",
+                    "condition_value": 0,
+                }
+            ]
+        scenarios.append(scenario)
+    return scenarios
+
+
+if __name__ == "__main__":
+    item_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+    scenario_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        run_main(item_count, work_dir)
+        catalog, coupons = load_snapshot(os.path.join(work_dir, "snapshot"))
+        audit = pd.concat(
+            pd.read_parquet(path)
+            for path in glob.glob(os.path.join(work_dir, "audit", "*", "*.parquet"))
+        )
+
+    simulator = Simulator(catalog, coupons)
+    result = simulator.run({"name": "now"})
+    expected = audit.set_index("item_manageNumber")["new_name"]
+    actual = result.set_index("item.manageNumber")["new_name"]
+    pd.testing.assert_series_equal(
+        actual, expected.reindex(actual.index), check_names=False
+    )
+    print(f"{len(actual)} simulated titles match main")
+
+    # 開始前の全品対象のクーポンは、その期間の日時を試算した時だけ使われる
+    assert "UPCOMING" in set(coupons["coupon_code"])
+    upcoming = {"at": (UPCOMING_START + timedelta(days=1)).isoformat()}
+    with_upcoming = simulator.run(upcoming)["new_name"]
+    without_upcoming = simulator.run({**upcoming, "remove_coupons": ["UPCOMING"]})
+    changed = (with_upcoming != without_upcoming["new_name"]).sum()
+    assert changed > 0
+    print(f"upcoming shop-wide coupon changes {changed} simulated titles")
+
+    scenarios = random_scenarios(np.random.default_rng(0), scenario_count)
+    started = time.perf_counter()
+    report, summary = simulator.report(scenarios)
+    elapsed = time.perf_counter() - started
+    print(
+        f"items={item_count:>6} scenarios={scenario_count} time={elapsed:8.3f}s "
+        f"({scenario_count / elapsed:.1f} scenarios/s) changed_rows={len(report)}"
+    )
@@ -0,0 +1,109 @@
+"""render_titles のゴールデンファイルでの確認とベンチマーク
+
+割引タイプ・割引率・価格・SKU数・商品名の組み合わせで商品名を作り、
+改修前の処理で作った golden_titles.txt とバイト単位で一致することを確認する。
+
+    python functions/bench/bench_title_renderer.py           # 確認とベンチマーク
+    python functions/bench/bench_title_renderer.py --update  # ゴールデンファイルの再作成
+"""
+
+import itertools
+import os
+import sys
+import time
+
+import pandas as pd
+
+import legacy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from title_renderer import render_titles  # noqa: E402
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "golden_titles.txt")
+
+TITLES = [
+    "【クーポンで1,000円→900円】商品A",
+    "【旧価格】【セール】商品B",
+    "商品C【送料無料】",
+    "商品D",
+    "",
+]
+PRICES = [1, 999, 1000, 12345, 1000000]
+# (割引タイプ, 割引額・割引率)。0は該当するクーポンがなかった時の値
+COUPONS = [
+    ("1", 100),
+    ("1", 500),
+    ("1", 999),
+    ("2", 10),
+    ("2", 49),
+    ("2", 50),
+    ("2", 51),
+    ("2", 90),
+    ("3", 10),
+    (0, 0),
+]
+SKU_NUMBERS = [1.0, 2.0, 5.0]
+
+
+def make_cases() -> pd.DataFrame:
+    rows = []
+    for title, price, (discount_type, discount), sku_number in itertools.product(
+        TITLES, PRICES, COUPONS, SKU_NUMBERS
+    ):
+        if discount_type == "1":
+            discount_price = price - discount
+            # 改修前の処理は割引後0円でゼロ除算になるため対象外
+            if discount_price == 0:
+                continue
+        elif discount_type == "2":
+            discount_price = price * (100 - discount) / 100
+        else:
+            discount_price = 0 if discount_type == 0 else price
+        rows.append(
+            {
+                "item.manageNumber": f"item-{len(rows)}",
+                "item.title": title,
+                "price": price,
+                "sku_number": sku_number,
+                "discount": float(discount),
+                "discount_type": discount_type,
+                "discount_price": float(discount_price),
+            }
+        )
+    df = pd.DataFrame(rows)
+    # 【】のない商品は、クーポンを選ばないため割引の列は空
+    no_brackets = ~df["item.title"].str.contains("【")
+    df.loc[no_brackets, ["discount", "discount_type", "discount_price"]] = None
+    return df
+
+
+def to_text(new_names: pd.Series) -> bytes:
+    return "".join(
+        f"{name}\n" if isinstance(name, str) else "<NA>\n" for name in new_names
+    ).encode("utf-8")
+
+
+if __name__ == "__main__":
+    cases = make_cases()
+    if "--update" in sys.argv:
+        with open(GOLDEN_PATH, "wb") as f:
+            f.write(to_text(legacy.render_titles(cases)["new_name"]))
+        print(f"wrote {GOLDEN_PATH} ({len(cases)} cases)")
+        sys.exit()
+
+    with open(GOLDEN_PATH, "rb") as f:
+        golden = f.read()
+    assert to_text(render_titles(cases)) == golden, "render_titles differs from golden"
+    print(f"{len(cases)} cases match {os.path.basename(GOLDEN_PATH)} byte for byte")
+
+    large = pd.concat([cases] * (100_000 // len(cases) + 1), ignore_index=True)
+    started = time.perf_counter()
+    render_titles(large)
+    new_elapsed = time.perf_counter() - started
+    print(f"[new   ] items={len(large)} time={new_elapsed:8.3f}s")
+    small = large.iloc[:5_000]
+    started = time.perf_counter()
+    legacy.render_titles(small)
+    old_elapsed = time.perf_counter() - started
+    print(f"[legacy] items={len(small)} time={old_elapsed:8.3f}s")
@@ -0,0 +1,330 @@
+"""ベンチマーク用の楽天RMS APIの疑似サーバー
+
+ローカルで起動し、main.py の RMS_BASE_URL をこのサーバーに向けて使う。
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+VALID_START = "2024-01-01T00:00:00+09:00"
+VALID_END = "2099-12-31T23:59:59+09:00"
+EXPIRED_END = "2024-06-30T23:59:59+09:00"
+
+
+def make_item(index: int) -> dict:
+    """items/search の1商品分のレスポンスを生成する"""
+    manage_number = f"item-{index:07d}"
+    # 奇数番目の商品はSKUを2つ持たせ、価格も変える
+    variants = {"sku-1": {"standardPrice": str(1000 + index % 50 * 100)}}
+    if index % 2 == 1:
+        variants["sku-2"] = {"standardPrice": str(1500 + index % 50 * 100)}
+    # 3商品に1つは【】のない（クーポンを反映しない）商品
+    if index % 3 == 2:
+        title = f"テスト商品{index}"
+    else:
+        title = f"【クーポンで1,000円→900円】テスト商品{index}"
+    return {
+        "item": {
+            "manageNumber": manage_number,
+            "itemNumber": manage_number,
+            "title": title,
+            "tagline": "キャッチコピー" * 5,
+            "productDescription": {"pc": "商品説明" * 50, "sp": "商品説明" * 50},
+            "variants": variants,
+        }
+    }
+
+
+def make_coupon(index: int, item_count: int) -> dict:
+    """クーポン1件分の情報を生成する
+
+    10件に1件は全品対象（itemType 4）、それ以外は1商品だけが対象のクーポン
+    """
+    shop_wide = index % 10 == 0
+    return {
+        "couponCode": f"COUPON-{index:07d}",
+        "couponName": f"テストクーポン{index}",
+        "couponStartDate": VALID_START,
+        # 7件に1件は期限切れ
+        "couponEndDate": EXPIRED_END if index % 7 == 6 else VALID_END,
+        "itemType": "4" if shop_wide else "1",
+        "discountType": "1" if index % 2 == 0 else "2",
+        "discountFactor": (
+            str(100 * (index % 5 + 1)) if index % 2 == 0 else str(10 * (index % 6 + 1))
+        ),
+        "itemUrl": None if shop_wide else f"item-{index % item_count:07d}",
+        # 全品対象クーポンの半分は利用金額の条件付き
+        "conditions": [("RS003", "3000")] if shop_wide and index % 20 == 0 else [],
+    }
+
+
+def coupon_xml(coupon: dict, with_conditions: bool) -> str:
+    fields = ["couponCode", "couponName", "couponStartDate", "couponEndDate"]
+    fields += ["itemType", "discountType", "discountFactor"]
+    # 値が None の項目は、タグごと出力しない
+    body = "".join(
+        f"<{field}>{coupon[field]}</{field}>"
+        for field in fields
+        if coupon[field] is not None
+    )
+    if coupon["itemUrl"] is not None:
+        body += f"<items><item><itemUrl>{coupon['itemUrl']}</itemUrl></item></items>"
+    if with_conditions:
+        body += "<otherConditions>"
+        for condition_type, start_value in coupon["conditions"]:
+            body += (
+                f"<otherCondition><conditionTypeCode>{condition_type}"
+                f"</conditionTypeCode><startValue>{start_value}</startValue>"
+                "</otherCondition>"
+            )
+        body += "</otherConditions>"
+    return f"<coupon>{body}</coupon>"
+
+
+def result_xml(interface_id: str, requests_xml: str, body: str) -> bytes:
+    """楽天のXMLレスポンスと同じく、リクエスト内容をstatusの中に含めて返す"""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><result><status>'
+        f"<interfaceId>{interface_id}</interfaceId><systemStatus>OK</systemStatus>"
+        f"<message>OK</message><requests>{requests_xml}</requests></status>"
+        f"{body}</result>"
+    ).encode()
+
+
+class FakeRms:
+    """疑似RMS APIの設定と状態
+
+    Args:
+        item_count (int): 商品数
+        coupon_count (int): クーポン数
+        latency (float): 1リクエストあたりの応答の遅延（秒）
+        rate_limit (float | None): 1秒あたりの上限。超えたリクエストには429を返す
+        max_concurrency (int | None): 同時に処理するリクエストの上限。超えたリクエストには
+            503を返す
+        failing_items (set | None): PATCHすると、本文のない400を返す商品管理番号
+    """
+
+    def __init__(
+        self,
+        item_count: int = 1000,
+        coupon_count: int = 100,
+        latency: float = 0.0,
+        rate_limit: float | None = None,
+        max_concurrency: int | None = None,
+        failing_items: set | None = None,
+    ):
+        self.item_count = item_count
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.max_concurrency = max_concurrency
+        self.failing_items = failing_items or set()
+        self.coupons = []
+        self.coupons_by_code = {}
+        self.coupons_by_item = {}
+        for i in range(coupon_count):
+            self.add_coupon(make_coupon(i, item_count))
+        self.patched_titles = {}
+        self.updated_at = {}
+        self.request_count = 0
+        self.throttled_count = 0
+        self.overloaded_count = 0
+        self._in_flight = 0
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def add_coupon(self, coupon: dict):
+        """make_coupon と同じ形のクーポンを追加する"""
+        self.coupons.append(coupon)
+        self.coupons_by_code[coupon["couponCode"]] = coupon
+        self.coupons_by_item.setdefault(coupon["itemUrl"], []).append(coupon)
+
+    def admit(self) -> bool:
+        """直近1秒間のリクエスト数が上限以内かを判定し、リクエストを記録する"""
+        with self._lock:
+            self.request_count += 1
+            if self.rate_limit is None:
+                return True
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.rate_limit:
+                self.throttled_count += 1
+                return False
+            self._recent.append(now)
+            return True
+
+    def current_item(self, index: int) -> dict:
+        """PATCHされた商品名を反映した商品を返す"""
+        item = make_item(index)
+        manage_number = item["item"]["manageNumber"]
+        if manage_number in self.patched_titles:
+            item["item"]["title"] = self.patched_titles[manage_number]
+        return item
+
+    def search_items(self, query: dict) -> dict:
+        hits = int(query.get("hits", ["100"])[0])
+        cursor_mark = query.get("cursorMark", ["*"])[0]
+        start = 0 if cursor_mark == "*" else int(cursor_mark)
+        if "updatedFrom" in query:
+            # 指定日時以降にPATCHされた商品のみ（初期の商品はサーバー起動前に更新済み扱い）
+            updated_from = datetime.fromisoformat(query["updatedFrom"][0])
+            with self._lock:
+                indices = sorted(
+                    int(manage_number.rsplit("-", 1)[-1])
+                    for manage_number, updated_at in self.updated_at.items()
+                    if updated_at >= updated_from
+                )
+        else:
+            indices = range(self.item_count)
+        end = min(start + hits, len(indices))
+        return {
+            "numFound": len(indices),
+            "results": [self.current_item(i) for i in indices[start:end]],
+            # 最終ページでは同じカーソルを返す（楽天APIと同じ挙動）
+            "nextCursorMark": str(end) if end > start else cursor_mark,
+        }
+
+    def search_coupons(self, query: dict) -> bytes:
+        hits = int(query.get("hits", ["100"])[0])
+        page = int(query.get("page", ["1"])[0])
+        item_url = query.get("itemUrl", [None])[0]
+        if item_url is None:
+            coupons = self.coupons
+        else:
+            coupons = self.coupons_by_item.get(item_url, [])
+        page_coupons = coupons[(page - 1) * hits : page * hits]
+        requests_xml = (
+            "<couponCode></couponCode><couponStartDate></couponStartDate>"
+            f"<couponEndDate></couponEndDate><itemUrl>{item_url or ''}</itemUrl>"
+            f"<hits>{hits}</hits><page>{page}</page>"
+        )
+        body = "".join(coupon_xml(c, with_conditions=False) for c in page_coupons)
+        return result_xml(
+            "coupon.search",
+            requests_xml,
+            f"<couponSearchResult><allCount>{len(coupons)}</allCount>"
+            f"<coupons>{body}</coupons></couponSearchResult>",
+        )
+
+    def get_coupon(self, query: dict) -> bytes:
+        coupon_code = query.get("couponCode", [""])[0]
+        coupon = self.coupons_by_code[coupon_code]
+        return result_xml(
+            "coupon.get",
+            f"<couponCode>{coupon_code}</couponCode>",
+            "<couponGetResult>"
+            + coupon_xml(coupon, with_conditions=True)
+            + "</couponGetResult>",
+        )
+
+    def make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, payload: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_json(self, status: int, body: dict):
+                self._send(status, json.dumps(body).encode(), "application/json")
+
+            def _send_xml(self, payload: bytes):
+                self._send(200, payload, "application/xml; charset=utf-8")
+
+            def _admit(self) -> bool:
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake.admit():
+                    return True
+                self._send_json(429, {"errors": [{"message": "Too Many Requests"}]})
+                return False
+
+            def _enter(self) -> bool:
+                """同時に処理するリクエストが上限以内かを判定する。超えた時は503を返す"""
+                with fake._lock:
+                    fake._in_flight += 1
+                    overloaded = (
+                        fake.max_concurrency is not None
+                        and fake._in_flight > fake.max_concurrency
+                    )
+                    if overloaded:
+                        fake.overloaded_count += 1
+                if overloaded:
+                    self._exit()
+                    self._send_json(503, {"errors": [{"message": "Unavailable"}]})
+                    return False
+                return True
+
+            def _exit(self):
+                with fake._lock:
+                    fake._in_flight -= 1
+
+            def do_GET(self):
+                if not self._enter():
+                    return
+                try:
+                    self._get()
+                finally:
+                    self._exit()
+
+            def do_PATCH(self):
+                # 429・503を返す時も、同じ接続の次のリクエストを読めるよう本文を読んでおく
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if not self._enter():
+                    return
+                try:
+                    self._patch(body)
+                finally:
+                    self._exit()
+
+            def _get(self):
+                if not self._admit():
+                    return
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path.endswith("/2.0/items/search"):
+                    self._send_json(200, fake.search_items(query))
+                elif url.path.endswith("/1.0/coupon/search"):
+                    self._send_xml(fake.search_coupons(query))
+                elif url.path.endswith("/1.0/coupon/get"):
+                    self._send_xml(fake.get_coupon(query))
+                else:
+                    self._send_json(404, {"errors": [{"message": "not found"}]})
+
+            def _patch(self, body: dict):
+                if not self._admit():
+                    return
+                url = urlparse(self.path)
+                manage_number = url.path.rsplit("/", 1)[-1]
+                if manage_number in fake.failing_items:
+                    self.send_response(400)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                with fake._lock:
+                    fake.patched_titles[manage_number] = body["title"]
+                    fake.updated_at[manage_number] = datetime.now(tz=timezone.utc)
+                self.send_response(204)
+                self.end_headers()
+
+        return Handler
+
+
+def start_server(fake: FakeRms) -> tuple[ThreadingHTTPServer, str]:
+    """疑似サーバーを別スレッドで起動し、サーバーとベースURLを返す"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), fake.make_handler())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}/es"
@@ -0,0 +1,204 @@
+"""ベンチマーク・比較用に残している、改修前の実装
+
+新しい実装と結果が一致するかの確認と、速度比較にのみ使う。
+"""
+
+import collections
+import re
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+
+
+def prefix_df(df: pd.DataFrame) -> pd.DataFrame:
+    # 価格情報と商品名、商品管理番号のみ抽出
+    df_1 = df[["item.manageNumber", "item.title"]]
+    df_2 = df.filter(like="standardPrice", axis="columns")
+    df_necessary = pd.concat([df_1, df_2], axis="columns").fillna("")
+    df_necessary["combined"] = df_necessary.iloc[:, 2:].apply(
+        lambda x: ",".join(x.astype(str)), axis=1
+    )
+    # 価格情報の取得
+    df_necessary.insert(0, "price", 0)
+    for index, row in df_necessary.iterrows():
+        s = row["combined"]
+        # ステップ1: カンマで分割してリストに変換
+        numbers_str_list = s.split(",")
+        # ステップ2: 空の要素を除去
+        numbers_str_list = [num for num in numbers_str_list if num]
+        # SKUのバリエーションによって、商品名が異なるため
+        # 重複しない要素の個数を判定して、格納
+        c = collections.Counter(numbers_str_list)
+        df_necessary.loc[index, "sku_number"] = len(c)
+        # ステップ3: 各要素を整数型に変換
+        numbers = [int(num) for num in numbers_str_list]
+        # ステップ4: min関数を使用して最小値を見つける
+        df_necessary.loc[index, "price"] = min(numbers)
+
+    return df_necessary.loc[
+        :, ["item.manageNumber", "item.title", "price", "sku_number"]
+    ]
+
+
+def select_coupon(price: int, coupon_df: pd.DataFrame, today) -> tuple:
+    """改修前の get_coupon_by_item のうち、1商品のクーポンを選ぶ部分
+
+    coupon_df は商品ごとのクーポンと全品対象のクーポンを結合したもの
+    """
+    coupon_df = coupon_df.copy()
+    coupon_df.loc[:, "condition_value"] = (
+        coupon_df.loc[:, "condition_value"].fillna(0).astype("int")
+    )
+    # 今日の日付を満たすクーポンがある？
+    coupon_df["start_date"] = pd.to_datetime(coupon_df["start_date"])
+    coupon_df["end_date"] = pd.to_datetime(coupon_df["end_date"])
+    available_coupon_df = coupon_df[
+        (coupon_df["start_date"] < pd.to_datetime(today))
+        & (coupon_df["end_date"] > pd.to_datetime(today))
+    ].copy()
+    # 割引後の値段が最も大きいクーポンを選んでいく
+    available_coupon_df.loc[:, "discount"] = available_coupon_df["discount"].astype(
+        "int32"
+    )
+    available_coupon_df = available_coupon_df.reset_index(drop=True)
+
+    # 該当するクーポンがないとき
+    if len(available_coupon_df) < 1:
+        return 0, 0, 0
+    # それぞれのクーポンを適用すると、いくらになるのか
+    for tmp_index, tmp_row in available_coupon_df.iterrows():
+        # 定額値引きのクーポン
+        if tmp_row["coupon_type"] == "1":
+            available_coupon_df.loc[tmp_index, "discounted_price"] = (
+                price - tmp_row["discount"]
+            )
+        # 定率値引きのクーポン
+        elif tmp_row["coupon_type"] == "2":
+            available_coupon_df.loc[tmp_index, "discounted_price"] = (
+                price * (100 - tmp_row["discount"]) / 100
+            )
+        # 上記以外は割引なしの値段に
+        else:
+            available_coupon_df.loc[tmp_index, "discounted_price"] = price
+    # 割引後の価格を小さい順に並べ替え
+    ordereded_available_coupon_df = available_coupon_df.sort_values(
+        by=["discounted_price"]
+    )
+    # 実質価格が小さいものから適用条件をチェックして、breakするような処理
+    for i, r in ordereded_available_coupon_df.iterrows():
+        if r["condition_value"] <= price:
+            return (
+                available_coupon_df.loc[i, "discount"],
+                available_coupon_df.loc[i, "coupon_type"],
+                available_coupon_df.loc[i, "discounted_price"],
+            )
+    return 0, 0, 0
+
+
+def extract_coupon_info(root_all_item: ET.Element) -> pd.DataFrame:
+    # クーポンコード
+    coupon_code_list = []
+    for value in root_all_item.iter("couponCode"):
+        coupon_code_list.append(value.text)
+    coupon_code_list.pop(0)
+    # 商品タイプ。4だと、すべての商品に反映可能なクーポン
+    itemtype_list = []
+    for value in root_all_item.iter("itemType"):
+        itemtype_list.append(value.text)
+    # クーポンの開始日時
+    start_date_list = []
+    for value in root_all_item.iter("couponStartDate"):
+        start_date_list.append(value.text)
+    start_date_list.pop(0)
+    # クーポンの終了日時
+    end_date_list = []
+    for value in root_all_item.iter("couponEndDate"):
+        end_date_list.append(value.text)
+    end_date_list.pop(0)
+    # クーポンタイプ（割引なのか、値引きなのか）も取得
+    coupont_type_list = []
+    for value in root_all_item.iter("discountType"):
+        coupont_type_list.append(value.text)
+    # クーポンの割引額
+    discount_list = []
+    for value in root_all_item.iter("discountFactor"):
+        discount_list.append(value.text)
+    data_all_item = {
+        "coupon_code": coupon_code_list,
+        "item_type": itemtype_list,
+        "start_date": start_date_list,
+        "end_date": end_date_list,
+        "discount": discount_list,
+        "coupon_type": coupont_type_list,
+    }
+    return pd.DataFrame(data_all_item)
+
+
+def render_titles(df_necessary: pd.DataFrame) -> pd.DataFrame:
+    """改修前の get_coupon_by_item のうち、新しい商品名を決める部分
+
+    df_necessary は discount、discount_type、discount_price まで決まっているもの
+    """
+    df_necessary = df_necessary.copy()
+    has_brackets = df_necessary["item.title"].str.contains(r"【[^】]*】", regex=True)
+    for index, row in df_necessary.iterrows():
+        old_title = ""
+        if has_brackets[index]:
+            old_title = re.sub(r"^【[^】]*】", "", row["item.title"])
+        else:
+            df_necessary.loc[index, "new_name"] = row["item.title"]
+            continue
+
+        ### 商品名の変更を開始 ###
+        # 型変換
+        old_price = int(df_necessary.loc[index, "price"])
+        discount_price = int(df_necessary.loc[index, "discount_price"])
+        discount = df_necessary.loc[index, "discount"]
+        ## 定額値引きのクーポンが最大割引の場合の新しい商品名
+        if df_necessary.loc[index, "discount_type"] == "1":
+            ## SKUの数によって場合分け
+            if old_price / discount_price >= 2:
+                df_necessary.loc[index, "new_name"] = (
+                    f"【クーポンで{old_price:,}円→{int(old_price*0.5):,}円】{old_title}"
+                )
+            else:
+                df_necessary.loc[index, "new_name"] = (
+                    f"【クーポンで{old_price:,}円→{discount_price:,}円】{old_title}"
+                )
+        ## 定率値引きのクーポンが最大割引の場合
+        # この時、割引率で場合わけ必要
+        elif df_necessary.loc[index, "discount_type"] == "2":
+            if discount > 50:
+                ## SKUの数によって場合分け
+                if row["sku_number"] > 1:
+                    df_necessary.loc[index, "new_name"] = (
+                        f"【クーポンで{old_price:,}円→{int(old_price*0.5):,}円～】{old_title}"
+                    )
+                elif row["sku_number"] == 1:
+                    df_necessary.loc[index, "new_name"] = (
+                        f"【クーポンで{old_price:,}円→{int(old_price*0.5):,}円】{old_title}"
+                    )
+            elif discount == 50:
+                ## SKUの数によって場合分け
+                if row["sku_number"] > 1:
+                    df_necessary.loc[index, "new_name"] = (
+                        f"【クーポンで{old_price:,}円→{discount_price:,}円～】{old_title}"
+                    )
+                elif row["sku_number"] == 1:
+                    df_necessary.loc[index, "new_name"] = (
+                        f"【クーポンで{old_price:,}円→{discount_price:,}円】{old_title}"
+                    )
+            else:
+                if row["sku_number"] > 1:
+                    df_necessary.loc[index, "new_name"] = (
+                        f"【クーポンで{old_price:,}円→{discount_price:,}円～】{old_title}"
+                    )
+                elif row["sku_number"] == 1:
+                    df_necessary.loc[index, "new_name"] = (
+                        f"【クーポンで{old_price:,}円→{discount_price:,}円】{old_title}"
+                    )
+        # その他
+        else:
+            df_necessary.loc[index, "new_name"] = "{}".format(old_title)
+
+    return df_necessary
@@ -0,0 +1,15 @@
+"""run_scenarios.py から子プロセスとして起動し、main を1回実行する
+
+疑似サーバーと同じプロセスで動かすとメモリ使用量が混ざるため、別プロセスにしている。
+接続先などの設定は、すべて環境変数で受け取る。
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import main  # noqa: E402
+
+if __name__ == "__main__":
+    main.main(None)
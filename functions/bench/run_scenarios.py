@@ -0,0 +1,117 @@
+"""疑似RMSサーバーに対して main を最初から最後まで実行するベンチマーク
+
+scenarios.json の各シナリオ（商品数・クーポン数・遅延・レート制限・環境変数）ごとに
+疑似サーバーを起動し、main を別プロセスで実行して、処理時間・スループット・
+ピークメモリ・API呼び出し回数を表示する。
+
+    python functions/bench/run_scenarios.py            # すべてのシナリオ
+    python functions/bench/run_scenarios.py 1k 10k     # 指定したシナリオのみ
+    python functions/bench/run_scenarios.py --output results.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_rms import FakeRms, start_server
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_scenario(scenario: dict) -> dict:
+    fake = FakeRms(
+        item_count=scenario["item_count"],
+        coupon_count=scenario["coupon_count"],
+        latency=scenario["latency"],
+        rate_limit=scenario["rate_limit"],
+    )
+    server, base_url = start_server(fake)
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = {
+            **os.environ,
+            "SERVICE_SECRETS": "dummy",
+            "LISCENSE_KEY": "dummy",
+            "RMS_BASE_URL": base_url,
+            "RMS_MAX_RPS": str(scenario["client_rps"]),
+            "RMS_MAX_WORKERS": str(scenario["client_workers"]),
+            "COUPON_CACHE_PATH": os.path.join(work_dir, "coupon_cache.sqlite3"),
+            "CHECKPOINT_DIR": os.path.join(work_dir, "checkpoint"),
+            "CATALOG_SNAPSHOT_PATH": os.path.join(work_dir, "catalog.parquet"),
+            "AUDIT_TABLE": "",
+            "METRICS_TABLE": "",
+            # PIPELINE_MODE など、シナリオごとに変える設定
+            **scenario.get("env", {}),
+        }
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, os.path.join(BENCH_DIR, "run_main.py")],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        elapsed = time.perf_counter() - started
+    server.shutdown()
+    if completed.returncode != 0:
+        raise RuntimeError(f"{scenario['name']} failed:\n{completed.stderr}")
+
+    # main が最後に出力する実行全体の計測結果
+    run_metrics = {}
+    for line in completed.stdout.splitlines():
+        if line.startswith("{") and '"run_metrics"' in line:
+            run_metrics = json.loads(line)
+    return {
+        "name": scenario["name"],
+        "item_count": scenario["item_count"],
+        "wall_seconds": round(elapsed, 2),
+        "items_per_second": round(scenario["item_count"] / elapsed, 1),
+        "peak_rss_mb": run_metrics.get("peak_rss_mb"),
+        "api_requests": fake.request_count,
+        "throttled": fake.throttled_count,
+        "patched": len(fake.patched_titles),
+        "stages": json.loads(run_metrics.get("stages", "[]")),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*", help="実行するシナリオ名（省略時はすべて）")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    with open(os.path.join(BENCH_DIR, "scenarios.json"), encoding="utf-8") as f:
+        scenarios = json.load(f)
+    if args.names:
+        scenarios = [s for s in scenarios if s["name"] in args.names]
+
+    results = []
+    for scenario in scenarios:
+        result = run_scenario(scenario)
+        results.append(result)
+        print(
+            f"{result['name']:>16} items={result['item_count']:>6} "
+            f"time={result['wall_seconds']:8.2f}s "
+            f"throughput={result['items_per_second']:8.1f} items/s "
+            f"peak_rss={result['peak_rss_mb']}MiB requests={result['api_requests']} "
+            f"429s={result['throttled']} patched={result['patched']}"
+        )
+        # chunked モードではチャンクごとに同じ段階が記録されるため、段階ごとに合計する
+        stages = {}
+        for stage in result["stages"]:
+            total = stages.setdefault(
+                stage["stage"], {"wall_seconds": 0.0, "api_calls": 0, "rows": 0}
+            )
+            total["wall_seconds"] += stage["wall_seconds"]
+            total["api_calls"] += stage["api_calls"]
+            total["rows"] += stage.get("rows", 0)
+        for name, total in stages.items():
+            print(
+                f"{'':>16} {name:<20} {total['wall_seconds']:8.2f}s "
+                f"calls={total['api_calls']:>6} rows={total['rows'] or '-'}"
+            )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
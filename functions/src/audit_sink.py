@@ -0,0 +1,200 @@
+"""新しい商品名の監査ログ
+
+処理した商品の新しい商品名を、型付きのArrowのレコードバッチとしてParquetファイルに
+少しずつ書き出し、最後に1回のロードジョブでBigQueryに追加する。
+商品名の変更（PATCH）の結果・応答時間・送信回数も、商品ごとに記録する。
+ロードジョブは完了まで待ち、書き込んだ行数と一致するか確認する。
+ローカルでの検証用に、BigQueryの代わりにディレクトリへ書き出すこともできる。
+再試行した実行では、前回までに結果が確定した商品を除いて書き込み、同じ商品を二重に記録しない。
+"""
+
+import functools
+import os
+import shutil
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# 監査ログの列。partition_date で日付ごとに分割する
+AUDIT_SCHEMA = pa.schema(
+    [
+        ("run_id", pa.string()),
+        ("item_manageNumber", pa.string()),
+        ("item_title", pa.string()),
+        ("price", pa.int64()),
+        ("sku_number", pa.int64()),
+        ("discount", pa.float64()),
+        ("discount_type", pa.string()),
+        ("discount_price", pa.float64()),
+        ("new_name", pa.string()),
+        ("upsert_result", pa.string()),
+        ("status_code", pa.int64()),
+        ("latency_seconds", pa.float64()),
+        ("attempts", pa.int64()),
+        ("upsert_error", pa.string()),
+        ("partition_date", pa.date32()),
+    ]
+)
+# get_coupon_by_item と upsert_items の結果の列名 → 監査ログの列名
+AUDIT_COLUMNS = {
+    "item.manageNumber": "item_manageNumber",
+    "item.title": "item_title",
+    "price": "price",
+    "sku_number": "sku_number",
+    "discount": "discount",
+    "discount_type": "discount_type",
+    "discount_price": "discount_price",
+    "new_name": "new_name",
+    "result": "upsert_result",
+    "status_code": "status_code",
+    "latency_seconds": "latency_seconds",
+    "attempts": "attempts",
+    "error": "upsert_error",
+}
+
+
+def to_record_batch(
+    df: pd.DataFrame, run_id: str, partition_date: date
+) -> pa.RecordBatch:
+    """get_coupon_by_item の結果を、監査ログのレコードバッチに変換する
+
+    Args:
+        df (pd.DataFrame): get_coupon_by_item の結果。upsert_items の結果の列がない時は、
+            その列を空にする
+        run_id (str): 実行のID
+        partition_date (date): 分割に使う日付
+    """
+    df_audit = df.reindex(columns=list(AUDIT_COLUMNS)).rename(columns=AUDIT_COLUMNS)
+    # クーポンがない商品の割引タイプは0（数値）のため、文字列にそろえる
+    discount_type = df_audit["discount_type"].astype("object")
+    df_audit["discount_type"] = discount_type.where(
+        discount_type.isna(), discount_type.astype("str")
+    )
+    df_audit.insert(0, "run_id", run_id)
+    df_audit["partition_date"] = partition_date
+    return pa.RecordBatch.from_pandas(
+        df_audit, schema=AUDIT_SCHEMA, preserve_index=False
+    )
+
+
+@functools.cache
+def bigquery_client(project: str):
+    """BigQueryのクライアント。google-cloud-bigquery の読み込みに時間が掛かるため、
+    最初に使う時に読み込んで作り、以降の実行（ウォームスタート）では使い回す
+
+    Returns:
+        google.cloud.bigquery.Client: projectのクライアント
+    """
+    from google.cloud import bigquery
+
+    return bigquery.Client(project=project)
+
+
+class AuditSink:
+    """監査ログの書き込み先
+
+    Args:
+        table (str): 書き込み先のBigQueryのテーブル（project.dataset.table）
+        path (str): 書き込み中のParquetファイルのパス
+        local_dir (str): 指定するとBigQueryの代わりに、このディレクトリの
+            partition_date=YYYY-MM-DD/<run_id>.parquet に書き出す
+        run_id (str): 実行のID
+        partition_date (date): 分割に使う日付
+        settled_items (set | None): 前回までの実行で、結果が確定した（エラー以外の）行を
+            書き込み済みの商品管理番号。これらの商品の行は書き込まない
+    """
+
+    def __init__(
+        self,
+        table: str,
+        path: str,
+        local_dir: str = "",
+        run_id: str = "",
+        partition_date: date | None = None,
+        settled_items: set | None = None,
+    ):
+        self.table = table
+        self.path = path
+        self.local_dir = local_dir
+        self.run_id = run_id
+        self.partition_date = partition_date or date.today()
+        self.settled_items = set(settled_items or ())
+        self.rows = 0
+        self._writer = None
+
+    def write(self, df: pd.DataFrame):
+        """処理した商品を書き足す。メモリには持たず、そのままファイルに書き出す
+
+        結果がエラーでない商品は settled_items に加え、次の実行では書き込まない。
+        エラーの商品は、再試行した実行の結果も書き込む
+        """
+        df = df[~df["item.manageNumber"].isin(self.settled_items)]
+        if len(df) == 0:
+            return
+        if "result" in df.columns:
+            settled = df.loc[df["result"] != "failed", "item.manageNumber"]
+        else:
+            settled = df["item.manageNumber"]
+        self.settled_items.update(settled)
+        batch = to_record_batch(df, self.run_id, self.partition_date)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, AUDIT_SCHEMA)
+        self._writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self) -> int:
+        """書き出したファイルを書き込み先に追加し、完了を確認する
+
+        Returns:
+            int: 追加した行数
+
+        Raises:
+            RuntimeError: 追加された行数が、書き出した行数と一致しない時
+        """
+        if self._writer is None:
+            return 0
+        self._writer.close()
+        self._writer = None
+        try:
+            if self.local_dir:
+                loaded = self._copy_local()
+            else:
+                loaded = self._load_bigquery()
+        finally:
+            os.remove(self.path)
+        if loaded != self.rows:
+            raise RuntimeError(
+                f"監査ログの書き込み件数が一致しない: {loaded}件 / {self.rows}件"
+            )
+        print(f"監査ログを書き込み: {loaded}件")
+        return loaded
+
+    def _load_bigquery(self) -> int:
+        from google.cloud import bigquery
+
+        client = bigquery_client(self.table.split(".")[0])
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            time_partitioning=bigquery.TimePartitioning(
+                type_=bigquery.TimePartitioningType.DAY, field="partition_date"
+            ),
+            # 既存のテーブルに、後から追加した列（upsert_result など）を足す
+            schema_update_options=[bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION],
+        )
+        with open(self.path, "rb") as f:
+            job = client.load_table_from_file(f, self.table, job_config=job_config)
+        # 失敗した時はここで例外になる
+        job.result()
+        return job.output_rows
+
+    def _copy_local(self) -> int:
+        directory = os.path.join(
+            self.local_dir, f"partition_date={self.partition_date.isoformat()}"
+        )
+        os.makedirs(directory, exist_ok=True)
+        destination = os.path.join(directory, f"{self.run_id}.parquet")
+        shutil.copyfile(self.path, destination)
+        return pq.ParquetFile(destination).metadata.num_rows
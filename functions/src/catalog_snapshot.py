@@ -0,0 +1,60 @@
+"""商品一覧のスナップショット
+
+前処理後の商品一覧（商品管理番号、商品名、価格、SKU数）をParquetで保存しておき、
+次回以降は前回の同期以降に更新された商品だけを取得して差し替える。
+"""
+
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+
+
+class CatalogSnapshot:
+    """商品一覧のスナップショットの読み書き
+
+    Args:
+        path (str): スナップショットのParquetファイルのパス。
+            同期日時と全件取得した日時は、同じ名前の .json ファイルに保存する
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.meta_path = os.path.splitext(path)[0] + ".json"
+
+    def load(self) -> tuple[pd.DataFrame, datetime, datetime] | None:
+        """スナップショットと、その同期日時、全件取得した日時を返す。なければNone"""
+        if not (os.path.exists(self.path) and os.path.exists(self.meta_path)):
+            return None
+        with open(self.meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        return (
+            pd.read_parquet(self.path),
+            datetime.fromisoformat(meta["synced_at"]),
+            datetime.fromisoformat(meta["full_synced_at"]),
+        )
+
+    def save(self, df: pd.DataFrame, synced_at: datetime, full_synced_at: datetime):
+        # 書き込み途中で落ちても壊れたファイルを読まないよう、書き終えてから置き換える
+        df.reset_index(drop=True).to_parquet(self.path + ".tmp", index=False)
+        os.replace(self.path + ".tmp", self.path)
+        with open(self.meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "synced_at": synced_at.isoformat(),
+                    "full_synced_at": full_synced_at.isoformat(),
+                    "item_count": len(df),
+                },
+                f,
+            )
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+
+def merge_catalog(snapshot: pd.DataFrame, changed: pd.DataFrame) -> pd.DataFrame:
+    """スナップショットの商品を、更新された商品で差し替える（新しい商品は追加）"""
+    return (
+        pd.concat([snapshot, changed], ignore_index=True)
+        .drop_duplicates(subset="item.manageNumber", keep="last")
+        .reset_index(drop=True)
+    )
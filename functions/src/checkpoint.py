@@ -0,0 +1,118 @@
+"""実行の途中経過（チェックポイント）の保存
+
+処理の段階ごとの結果と、商品名の変更が完了した商品を日付ごとのディレクトリに保存する。
+途中で失敗しても、次の実行では完了した段階・商品を飛ばして続きから再開する。
+同じ日の実行が並行して動かないよう、実行中はリース（実行中の印）を持つ。
+"""
+
+import os
+import shutil
+import threading
+import time
+from typing import Callable
+
+import pandas as pd
+
+
+class Checkpoint:
+    """1日分の実行のチェックポイント
+
+    Args:
+        directory (str): チェックポイントを保存するディレクトリ
+        run_id (str): 実行の識別子。同じrun_idの実行は途中から再開する
+    """
+
+    def __init__(self, directory: str, run_id: str):
+        self.directory = directory
+        self.path = os.path.join(directory, run_id)
+        self._lock = threading.Lock()
+        # 前日以前の実行のチェックポイントは使わないため削除
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name != run_id:
+                    shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _stage_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.pkl")
+
+    def stage(self, name: str, func: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """保存済みの段階は読み込み、未完了の段階はfuncを実行して結果を保存する"""
+        stage_path = self._stage_path(name)
+        if os.path.exists(stage_path):
+            print(f"チェックポイントから再開: {name}")
+            return pd.read_pickle(stage_path)
+        result = func()
+        # 書き込み途中で落ちても壊れたファイルを読まないよう、書き終えてから置き換える
+        result.to_pickle(stage_path + ".tmp")
+        os.replace(stage_path + ".tmp", stage_path)
+        return result
+
+    def mark(self, name: str):
+        """結果を持たない段階（BigQueryへの書き込みなど）の完了を記録する"""
+        open(self._stage_path(name), "wb").close()
+
+    def done_items(self) -> set:
+        """商品名の変更が完了した商品管理番号"""
+        progress_path = os.path.join(self.path, "upsert_progress.txt")
+        if not os.path.exists(progress_path):
+            return set()
+        with open(progress_path, encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f}
+
+    def mark_item_done(self, manage_number: str):
+        """商品名の変更が完了した商品を1件ずつ追記する"""
+        progress_path = os.path.join(self.path, "upsert_progress.txt")
+        with self._lock, open(progress_path, "a", encoding="utf-8") as f:
+            f.write(f"{manage_number}\n")
+
+    def audited_items(self) -> set:
+        """監査ログに、結果が確定した行を書き込み済みの商品管理番号"""
+        audit_path = os.path.join(self.path, "audit_progress.txt")
+        if not os.path.exists(audit_path):
+            return set()
+        with open(audit_path, encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f}
+
+    def mark_items_audited(self, manage_numbers: set):
+        """監査ログへの書き込みを確定した後に、書き込み済みの商品管理番号を保存する"""
+        audit_path = os.path.join(self.path, "audit_progress.txt")
+        with open(audit_path + ".tmp", "w", encoding="utf-8") as f:
+            f.writelines(f"{manage_number}\n" for manage_number in manage_numbers)
+        os.replace(audit_path + ".tmp", audit_path)
+
+    def acquire_lease(self, seconds: float) -> bool:
+        """実行中の印を作る。別の実行が印を持っている時はFalse
+
+        Args:
+            seconds (float): 印の有効期間。これより古い印は、途中で落ちた実行のものとして引き継ぐ
+        """
+        lease_path = os.path.join(self.path, "lease")
+        try:
+            os.close(os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            if time.time() - os.path.getmtime(lease_path) < seconds:
+                return False
+            os.utime(lease_path)
+        return True
+
+    def release_lease(self):
+        """実行中の印を消す"""
+        try:
+            os.remove(os.path.join(self.path, "lease"))
+        except FileNotFoundError:
+            pass
+
+    def completed_within(self, seconds: float) -> bool:
+        """seconds 秒以内に、同じ日の実行がすべての段階を完了したか"""
+        completed_path = self._stage_path("completed")
+        return (
+            os.path.exists(completed_path)
+            and time.time() - os.path.getmtime(completed_path) < seconds
+        )
+
+    def clear(self):
+        """すべての段階が完了したら、チェックポイントを削除し、完了の印だけを残す"""
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+        self.mark("completed")
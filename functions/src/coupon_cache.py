@@ -0,0 +1,85 @@
+"""クーポンの適用条件（coupon/get の結果）を保存するSQLiteのキャッシュ
+
+適用条件はクーポンコードごとに変わらないため、一度取得したものはクーポンの
+終了日時まで保存し、次回以降の実行ではAPIを呼ばずに使う。
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class CouponConditionCache:
+    """クーポンコードをキーにした適用条件のキャッシュ
+
+    Args:
+        path (str): SQLiteのファイルパス
+    """
+
+    def __init__(self, path: str):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS coupon_condition (
+                coupon_code TEXT PRIMARY KEY,
+                conditions TEXT NOT NULL,
+                end_date TEXT NOT NULL
+            )
+            """)
+        self._connection.commit()
+
+    def get(self, coupon_code: str) -> list | None:
+        """保存済みの適用条件を返す。なければNone
+
+        Returns:
+            list | None: [condition_type, condition_value] のリスト
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT conditions FROM coupon_condition WHERE coupon_code = ?",
+                (coupon_code,),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, coupon_code: str, conditions: list, end_date: datetime):
+        """適用条件を、クーポンの終了日時まで保存する"""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO coupon_condition VALUES (?, ?, ?)",
+                (coupon_code, json.dumps(conditions), end_date.isoformat()),
+            )
+            self._connection.commit()
+
+    def purge(self, now: datetime) -> int:
+        """終了日時を過ぎたクーポンを削除し、削除した件数を返す"""
+        with self._lock:
+            # 終了日時はタイムゾーン付きのISO形式で保存しているため、Pythonで比較する
+            expired = [
+                coupon_code
+                for coupon_code, end_date in self._connection.execute(
+                    "SELECT coupon_code, end_date FROM coupon_condition"
+                )
+                if datetime.fromisoformat(end_date) <= now
+            ]
+            self._connection.executemany(
+                "DELETE FROM coupon_condition WHERE coupon_code = ?",
+                [(coupon_code,) for coupon_code in expired],
+            )
+            self._connection.commit()
+            return len(expired)
+
+    def report(self) -> str:
+        """ヒット率と、節約できたAPI呼び出し回数"""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0.0
+        return (
+            f"クーポン条件キャッシュ: ヒット{self.hits}件 / 取得{self.misses}件 "
+            f"（ヒット率{hit_rate:.1f}%、API呼び出し{self.hits}回削減）"
+        )
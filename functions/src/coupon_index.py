@@ -0,0 +1,92 @@
+"""有効期間で引けるクーポンの索引
+
+クーポンの日時は作成時に1回だけ変換し、商品管理番号の順に並べておく。
+有効期間の開始・終了の日時で時間軸を区切り、ある日時がどの区間に入るかを二分探索で
+求めて、その区間で有効なクーポンを返す（区間ごとの結果は初回に計算して使い回す）。
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 全品対象のクーポンの商品管理番号
+SHOP_WIDE = ""
+
+
+def prepare_coupons(coupon_df: pd.DataFrame) -> pd.DataFrame:
+    """クーポン情報を、割引の計算に使う型に変換する
+
+    日時は、タイムゾーンの異なる文字列が混ざっていても比較できるようUTCにそろえる。
+    割引の値（discountFactor）は種類が1・2のクーポンでしか使わないため、
+    ない時は0として扱う
+    """
+    if "condition_value" not in coupon_df.columns:
+        coupon_df = coupon_df.assign(condition_value=0)
+    return coupon_df.assign(
+        start_date=pd.to_datetime(coupon_df["start_date"], utc=True),
+        end_date=pd.to_datetime(coupon_df["end_date"], utc=True),
+        discount=pd.to_numeric(coupon_df["discount"]).fillna(0).astype("int32"),
+        condition_value=coupon_df["condition_value"].fillna(0).astype("int"),
+    )
+
+
+class CouponIndex:
+    """有効期間で引けるクーポンの索引
+
+    Args:
+        coupon_df (pd.DataFrame): クーポン情報。item.manageNumber の列がなければ、
+            すべて全品対象のクーポンとして扱う
+    """
+
+    def __init__(self, coupon_df: pd.DataFrame):
+        coupons = prepare_coupons(coupon_df)
+        if "item.manageNumber" not in coupons.columns:
+            coupons = coupons.assign(**{"item.manageNumber": SHOP_WIDE})
+        # 同じ商品のクーポンは元の順番のまま並べる（割引額が同じ時の優先順位のため）
+        self.coupons = coupons.sort_values(
+            "item.manageNumber", kind="stable"
+        ).reset_index(drop=True)
+        self._keys = self.coupons["item.manageNumber"].to_numpy(dtype=object)
+        self._starts = self._to_ns(self.coupons["start_date"])
+        self._ends = self._to_ns(self.coupons["end_date"])
+        # 有効期間の開始・終了の日時。この間の区間では、有効なクーポンは変わらない
+        self._boundaries = np.unique(np.concatenate([self._starts, self._ends]))
+        self._valid_rows = {}
+
+    def __len__(self) -> int:
+        return len(self.coupons)
+
+    @staticmethod
+    def _to_ns(dates: pd.Series) -> np.ndarray:
+        return dates.dt.tz_convert(None).to_numpy(dtype="datetime64[ns]").view("int64")
+
+    def valid_rows(self, when: datetime) -> np.ndarray:
+        """when に有効なクーポン（開始 < when < 終了）の行番号。商品管理番号の順"""
+        ns = pd.Timestamp(when).value
+        position = int(np.searchsorted(self._boundaries, ns))
+        on_boundary = (
+            position < len(self._boundaries) and self._boundaries[position] == ns
+        )
+        # 区切りの日時ちょうどと、その前後の区間を別の区間として扱う
+        segment = 2 * position + int(on_boundary)
+        if segment not in self._valid_rows:
+            self._valid_rows[segment] = np.flatnonzero(
+                (self._starts < ns) & (self._ends > ns)
+            )
+        return self._valid_rows[segment]
+
+    def valid_at(self, when: datetime) -> pd.DataFrame:
+        """when に有効なクーポン"""
+        return self.coupons.iloc[self.valid_rows(when)]
+
+    def lookup(self, manage_number: str, when: datetime) -> pd.DataFrame:
+        """when に有効な、商品管理番号 manage_number の商品のクーポンと全品対象のクーポン"""
+        rows = self.valid_rows(when)
+        keys = self._keys[rows]
+        found = []
+        for key in (manage_number, SHOP_WIDE):
+            start = np.searchsorted(keys, key, side="left")
+            end = np.searchsorted(keys, key, side="right")
+            found.append(rows[start:end])
+        return self.coupons.iloc[np.concatenate(found)]
@@ -0,0 +1,76 @@
+"""クーポンAPI（coupon/search、coupon/get）のXMLレスポンスの解析
+
+レスポンスを先頭から1回だけ読み、<coupon>要素ごとに1件のレコードとして取り出す。
+各項目は列ごとのリストにまとめて返すため、そのままDataFrameにできる。
+"""
+
+import io
+from typing import NamedTuple
+
+from lxml import etree
+
+# <coupon>直下のタグと、DataFrameの列名の対応
+COUPON_FIELDS = {
+    "couponCode": "coupon_code",
+    "itemType": "item_type",
+    "couponStartDate": "start_date",
+    "couponEndDate": "end_date",
+    "discountFactor": "discount",
+    "discountType": "coupon_type",
+}
+
+
+class CouponResponse(NamedTuple):
+    """クーポンAPIのレスポンスの解析結果
+
+    Attributes:
+        all_count (int | None): 検索条件に該当するクーポンの合計数
+        coupons (dict): COUPON_FIELDS の列名ごとの値のリスト。1要素が1クーポン
+        conditions (dict): coupon_code、condition_type、condition_value ごとの値のリスト。
+            1要素が1つの適用条件
+    """
+
+    all_count: int | None
+    coupons: dict
+    conditions: dict
+
+
+def parse_coupon_response(content: bytes) -> CouponResponse:
+    """クーポンAPIのXMLレスポンスを1回の走査で解析する
+
+    status内に含まれるリクエスト内容（couponCodeなど）は<coupon>の外にあるため、
+    自動的に対象外になる。タグがないクーポンの項目はNoneになり、他の項目とずれない。
+
+    Args:
+        content (bytes): APIのレスポンスボディ
+    """
+    all_count = None
+    coupons = {column: [] for column in COUPON_FIELDS.values()}
+    conditions = {"coupon_code": [], "condition_type": [], "condition_value": []}
+
+    for _, element in etree.iterparse(
+        io.BytesIO(content), events=("end",), tag=("coupon", "allCount")
+    ):
+        if element.tag == "allCount":
+            all_count = int(element.text)
+            continue
+
+        record = dict.fromkeys(COUPON_FIELDS.values())
+        for child in element:
+            column = COUPON_FIELDS.get(child.tag)
+            if column is not None:
+                record[column] = child.text
+        for column, value in record.items():
+            coupons[column].append(value)
+        # クーポンの適用条件（coupon/getのみ）
+        for condition in element.iter("otherCondition"):
+            conditions["coupon_code"].append(record["coupon_code"])
+            conditions["condition_type"].append(condition.findtext("conditionTypeCode"))
+            conditions["condition_value"].append(condition.findtext("startValue"))
+
+        # 読み終わった要素は解放して、メモリを一定に保つ
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+    return CouponResponse(all_count, coupons, conditions)
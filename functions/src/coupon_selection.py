@@ -0,0 +1,162 @@
+"""商品ごとに最も割引額の大きいクーポンを選ぶ処理
+
+商品×クーポンのすべての組み合わせ（今日有効なクーポンのみ）について、
+割引後の価格をNumPyでまとめて計算し、商品ごとに最小のものを選ぶ。
+組み合わせは商品を分けて作り、一度にメモリに持つ数を抑える。
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 一度に作る商品×全品対象のクーポンの組み合わせの数の目安。メモリの使用量を商品数によらず抑える
+MAX_PAIRS = 200_000
+COUPON_COLUMNS = [
+    "start_date",
+    "end_date",
+    "discount",
+    "coupon_type",
+    "condition_value",
+]
+
+
+def coupon_arrays(coupons: pd.DataFrame, today: datetime) -> dict:
+    """クーポンの割引の計算に使う列をNumPyの配列にし、今日有効かどうかを判定する
+
+    日時はUTCのナノ秒の整数で比較する（タイムゾーン付きの日時のまま比較すると遅いため）
+    """
+    now = pd.Timestamp(today).value
+    start = pd.to_datetime(coupons["start_date"], utc=True).dt.tz_convert(None)
+    end = pd.to_datetime(coupons["end_date"], utc=True).dt.tz_convert(None)
+    coupon_type = coupons["coupon_type"].to_numpy(dtype=object)
+    return {
+        "valid": (start.to_numpy().view("int64") < now)
+        & (end.to_numpy().view("int64") > now),
+        "discount": coupons["discount"].to_numpy(dtype="int64"),
+        "coupon_type": coupon_type,
+        # 割引タイプの判定用。1:定額値引き、2:定率値引き、0:それ以外
+        "type_code": np.select(
+            [coupon_type == "1", coupon_type == "2"], [1, 2], 0
+        ).astype("int8"),
+        "condition_value": coupons["condition_value"].to_numpy(dtype="int64"),
+    }
+
+
+def select_best_coupon(
+    items: pd.DataFrame,
+    item_coupons: pd.DataFrame,
+    common_coupons: pd.DataFrame,
+    today: datetime,
+) -> pd.DataFrame:
+    """商品ごとに、割引後の価格が最も小さく適用条件を満たすクーポンを選ぶ
+
+    割引後の価格が同じクーポンが複数ある時は、商品ごとのクーポン、
+    全品対象のクーポンの順に、先に並んでいるものを選ぶ。
+
+    Args:
+        items (pd.DataFrame): item.manageNumber と price を持つ商品の一覧
+        item_coupons (pd.DataFrame): item.manageNumber を持つ商品ごとのクーポン
+        common_coupons (pd.DataFrame): 全品に適用できるクーポン
+        today (datetime): この日時に有効なクーポンのみを対象にする
+
+    Returns:
+        pd.DataFrame: items と同じindexで、discount、discount_type、discount_price の列。
+            該当するクーポンがない商品はすべて0
+    """
+    item_count = len(items)
+    prices = items["price"].to_numpy(dtype="int64")
+    own = coupon_arrays(item_coupons, today)
+    common = coupon_arrays(common_coupons, today)
+
+    # 商品ごとのクーポン：商品の位置と対応付け
+    position = pd.Series(np.arange(item_count), index=items["item.manageNumber"])
+    item_pos = position.reindex(item_coupons["item.manageNumber"]).to_numpy()
+    # 今日が有効期間内のクーポンだけを組み合わせる
+    own_rows = np.flatnonzero(~np.isnan(item_pos) & own["valid"])
+    item_pos = item_pos[own_rows].astype("int64")
+    # 全品対象のクーポン：すべての商品と組み合わせる
+    common_rows = np.flatnonzero(common["valid"])
+
+    # 商品ごとのクーポン、全品対象のクーポンの順に1つの表にし、組み合わせは表の行番号で持つ
+    # （同じ割引後価格の時は、行番号の小さいものを優先する）
+    coupons = {
+        key: np.concatenate([own[key], common[key]])
+        for key in ("discount", "coupon_type", "type_code", "condition_value")
+    }
+    common_rows = len(own["valid"]) + common_rows
+
+    result = pd.DataFrame(
+        {
+            "discount": np.zeros(item_count, dtype="float64"),
+            "discount_type": np.zeros(item_count, dtype=object),
+            "discount_price": np.zeros(item_count, dtype="float64"),
+        },
+        index=items.index,
+    )
+    # 商品×全品対象のクーポンの組み合わせが MAX_PAIRS 程度までになるよう、商品を分けて選ぶ
+    batch_size = max(1, MAX_PAIRS // max(1, len(common_rows)))
+    for start in range(0, item_count, batch_size):
+        stop = min(start + batch_size, item_count)
+        in_batch = (item_pos >= start) & (item_pos < stop)
+        pair_pos = np.concatenate(
+            [item_pos[in_batch], np.repeat(np.arange(start, stop), len(common_rows))]
+        )
+        pair_coupon = np.concatenate(
+            [own_rows[in_batch], np.tile(common_rows, stop - start)]
+        )
+        best_pos, best_coupon, best_price = best_pairs(
+            pair_pos, pair_coupon, coupons, prices
+        )
+        result.iloc[best_pos, 0] = coupons["discount"][best_coupon]
+        result.iloc[best_pos, 1] = coupons["coupon_type"][best_coupon]
+        result.iloc[best_pos, 2] = best_price
+    return result
+
+
+def best_pairs(
+    pair_pos: np.ndarray, pair_coupon: np.ndarray, coupons: dict, prices: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """商品とクーポンの組み合わせから、商品ごとに割引後の価格が最小のものを選ぶ
+
+    Args:
+        pair_pos (np.ndarray): 組み合わせごとの商品の位置
+        pair_coupon (np.ndarray): 組み合わせごとのクーポンの行番号
+        coupons (dict): coupon_arrays の列をつなげたクーポンの表
+        prices (np.ndarray): 商品の位置ごとの価格
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: 商品の位置、選んだクーポンの行番号、
+            割引後の価格。条件を満たすクーポンがない商品は含まない
+    """
+    discount = coupons["discount"][pair_coupon]
+    type_code = coupons["type_code"][pair_coupon]
+    condition_value = coupons["condition_value"][pair_coupon]
+
+    price = prices[pair_pos]
+    # 定額値引きは価格から引き、定率値引きは割合で計算、それ以外は割引なし
+    discounted_price = np.where(
+        type_code == 1,
+        price - discount,
+        np.where(type_code == 2, price * (100 - discount) / 100, price),
+    )
+
+    # 利用金額（RS003）の条件を満たすものだけ残す
+    available = condition_value <= price
+
+    # 商品ごとに割引後の価格が最小のものを先頭に並べ、先頭を採用
+    candidates = np.flatnonzero(available)
+    candidates = candidates[
+        np.lexsort(
+            (
+                pair_coupon[candidates],
+                discounted_price[candidates],
+                pair_pos[candidates],
+            )
+        )
+    ]
+    sorted_pos = pair_pos[candidates]
+    is_first = np.ones(len(candidates), dtype=bool)
+    is_first[1:] = sorted_pos[1:] != sorted_pos[:-1]
+    best = candidates[is_first]
+    return sorted_pos[is_first], pair_coupon[best], discounted_price[best]
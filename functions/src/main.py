@@ -1,61 +1,212 @@
 # %%
 import base64
-import collections
+import functools
+import json
+import math
+import multiprocessing
 import os
-import re
-import xml.etree.ElementTree as ET
-from datetime import date, datetime
-from time import sleep
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterator
 from zoneinfo import ZoneInfo
 
+import numpy as np
 import pandas as pd
 import requests
 from dotenv import load_dotenv
-from google.cloud import bigquery
 
+from audit_sink import AuditSink, bigquery_client
+from catalog_snapshot import CatalogSnapshot, merge_catalog
+from checkpoint import Checkpoint
+from coupon_cache import CouponConditionCache
+from coupon_index import CouponIndex
+from coupon_parser import parse_coupon_response
+from metrics import RunMetrics
+from rms_client import RETRY_STATUS_CODES, RmsClient
+from simulation import save_snapshot
+from title_evaluation import evaluate_titles
+from title_renderer import has_brackets
+
+# 設定の環境変数を読むため、.env.yaml だけは読み込み時に読む
 load_dotenv(".env.yaml")
 
 
-# 楽天の認証情報の設定
-# https://cat-marketing.jp/2022/12/16/1471/
-b64 = os.environ["SERVICE_SECRETS"] + ":" + os.environ["LISCENSE_KEY"]
-b64_en = base64.b64encode(b64.encode())
+@functools.cache
+def rms_headers() -> dict:
+    """楽天の認証ヘッダー。最初のリクエストの時に作り、以降の実行でも使い回す"""
+    # 楽天の認証情報の設定
+    # https://cat-marketing.jp/2022/12/16/1471/
+    b64 = os.environ["SERVICE_SECRETS"] + ":" + os.environ["LISCENSE_KEY"]
+    b64_en = base64.b64encode(b64.encode())
+
+    return {
+        "Authorization": b"ESA " + b64_en,
+        "Content-Type": "application/json; charset=utf-8",
+    }
+
 
-headers = {
-    "Authorization": b"ESA " + b64_en,
-    "Content-Type": "application/json; charset=utf-8",
-}
 hits_limit = 100
+# ローカルの疑似サーバーでベンチマークできるよう、接続先を環境変数で切り替え可能に
+RMS_BASE_URL = os.environ.get("RMS_BASE_URL", "https://api.rms.rakuten.co.jp/es")
+# クーポンの適用条件のキャッシュ。Cloud Functionsで書き込めるのは/tmpのみ
+COUPON_CACHE_PATH = os.environ.get(
+    "COUPON_CACHE_PATH", "/tmp/rakuten_coupon_condition_cache.sqlite3"
+)
+# 商品一覧の取得方法。incremental の時は、スナップショットとの差分のみ取得する
+CATALOG_SYNC_MODE = os.environ.get("CATALOG_SYNC_MODE", "full")
+CATALOG_SNAPSHOT_PATH = os.environ.get(
+    "CATALOG_SNAPSHOT_PATH", "/tmp/rakuten_catalog_snapshot.parquet"
+)
+CATALOG_FULL_REFRESH_DAYS = int(os.environ.get("CATALOG_FULL_REFRESH_DAYS", "7"))
+# 途中経過の保存先。失敗した実行は、次の実行でここから再開する
+CHECKPOINT_DIR = os.environ.get(
+    "CHECKPOINT_DIR", "/tmp/rakuten_title_rename_checkpoint"
+)
+# 同じ日の実行が並行して動かないよう持つリースの有効期間（秒）。関数のタイムアウトに合わせる
+RUN_LEASE_SECONDS = float(os.environ.get("RUN_LEASE_SECONDS", "3600"))
+# 1秒あたりのリクエスト上限と同時実行数。既定値は従来のsleep(1)と同じ1秒1リクエスト
+rms = RmsClient(
+    headers=rms_headers,
+    base_url=RMS_BASE_URL,
+    max_rps=float(os.environ.get("RMS_MAX_RPS", "1")),
+    max_workers=int(os.environ.get("RMS_MAX_WORKERS", "4")),
+)
+# 処理の段階ごとの計測。METRICS_TABLE を指定すると、実行ごとに1行BigQueryに書き込む
+run_metrics = RunMetrics(rms)
+METRICS_TABLE = os.environ.get("METRICS_TABLE", "")
+# 新しい商品名を書き込む監査ログのBigQueryのテーブル。空にすると書き込まない
+AUDIT_TABLE = os.environ.get(
+    "AUDIT_TABLE", "doctor-ilcsi.dl_rakuten_title_renmae.audit"
+)
+# 指定すると、監査ログをBigQueryの代わりにこのディレクトリに書き出す（ローカルでの検証用）
+AUDIT_LOCAL_DIR = os.environ.get("AUDIT_LOCAL_DIR", "")
+# 処理の方法。chunked の時は商品一覧をCHUNK_SIZE件ずつ、取得からBigQueryへの書き込みまで
+# 順に処理し、商品数によらずメモリの使用量を一定に保つ
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "full")
+# 指定すると、full の時に商品一覧とクーポンをここに保存する（simulation.py で試算に使う）
+SIMULATION_SNAPSHOT_DIR = os.environ.get("SIMULATION_SNAPSHOT_DIR", "")
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", "1000"))
+# sharded の時は、商品をSHARD_COUNT個に分けてワーカーで並列に処理する。
+# WORKER_URL が空の時は、ローカルのプロセスで処理する
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "4"))
+WORKER_URL = os.environ.get("WORKER_URL", "")
+
+
+def iter_item_pages(updated_from: datetime | None = None) -> Iterator[list]:
+    """商品の一覧をページ単位で取得するジェネレータ。
+    cursorMarkを進めながらAPIを呼び出し、取得したページをその都度返す
 
+    Args:
+        updated_from (datetime | None): 指定した日時以降に更新された商品のみ取得する
 
-def get_item_list() -> pd.DataFrame:
+    Yields:
+        list: 1ページ分（最大hits_limit件）の商品のレスポンスデータ
+    """
+    params = {"isHiddenItem": "false", "hits": hits_limit}
+    if updated_from is not None:
+        params["updatedFrom"] = updated_from.isoformat(timespec="seconds")
+    cursor_mark = "*"
+    while True:
+        response = rms.get(
+            "/2.0/items/search", params={**params, "cursorMark": cursor_mark}
+        )
+        response.raise_for_status()
+        body = response.json()
+        results = body["results"]
+        if len(results) > 0:
+            yield results
+        # 次のカーソルが変わらなければ最終ページ
+        next_cursor_mark = body["nextCursorMark"]
+        if len(results) == 0 or next_cursor_mark == cursor_mark:
+            break
+        cursor_mark = next_cursor_mark
+
+
+@run_metrics.stage("get_item_list")
+def get_item_list(updated_from: datetime | None = None) -> pd.DataFrame:
     """商品の一覧を取得する関数。１回のAPIの取得上限があるため、繰り返しAPIを呼び出し
 
+    Args:
+        updated_from (datetime | None): 指定した日時以降に更新された商品のみ取得する
+
     Returns:
         pd.DataFrame: すべての商品のレスポンスデータを統合したDataFrame
     """
-    serch_endpoint = f"https://api.rms.rakuten.co.jp/es/2.0/items/search?isHiddenItem=false&hits={hits_limit}"
+    # ページごとにconcatすると件数の二乗で遅くなるため、最後に1回だけDataFrame化
+    items = [item for page in iter_item_pages(updated_from) for item in page]
+    return pd.json_normalize(items)
 
-    first_serch_endpoint = serch_endpoint + "&cursorMark=*"
-    response = requests.get(url=first_serch_endpoint, headers=headers)
-    df_items = pd.json_normalize(response.json()["results"])
 
-    pre_cursor_mark = "*"
-    post_cursor_mark = response.json()["nextCursorMark"]
+def normalize_items(items: list) -> pd.DataFrame:
+    """商品のレスポンスデータから、prefix_df で使う列のみをDataFrameにする
 
-    while pre_cursor_mark != post_cursor_mark:
-        response_while = requests.get(
-            url=(serch_endpoint + "&cursorMark=" + post_cursor_mark), headers=headers
-        )
-        df_items = pd.concat(
-            [df_items, pd.json_normalize(response_while.json()["results"])]
-        )
-        pre_cursor_mark = post_cursor_mark
-        post_cursor_mark = response.json()["nextCursorMark"]
-    df_items = df_items.reset_index(drop=True)
-    return df_items
+    json_normalize と同じ列名で、商品管理番号・商品名・SKUごとの価格だけを取り出す
+    （商品説明などの大きな項目は持たない）
+
+    Args:
+        items (list): 商品のレスポンスデータ
+    """
+    rows = []
+    for result in items:
+        item = result["item"]
+        row = {"item.manageNumber": item["manageNumber"], "item.title": item["title"]}
+        for sku, variant in (item.get("variants") or {}).items():
+            row[f"item.variants.{sku}.standardPrice"] = variant.get("standardPrice")
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+@run_metrics.stage("fetch_catalog_chunk")
+def fetch_catalog_chunk(
+    pages: Iterator[list], items: list, chunk_size: int
+) -> pd.DataFrame | None:
+    """商品の一覧を、chunk_size件たまるか最終ページになるまで取得して、1チャンク分を返す
+
+    Args:
+        pages (Iterator[list]): iter_item_pages のジェネレータ
+        items (list): 取得済みで、まだ返していない商品。返した分は取り除く
+        chunk_size (int): 1回に返す商品数
+
+    Returns:
+        pd.DataFrame | None: normalize_items で必要な列のみにした商品一覧。
+            返す商品がなければNone
+    """
+    while len(items) < chunk_size:
+        page = next(pages, None)
+        if page is None:
+            break
+        items.extend(page)
+    chunk = items[:chunk_size]
+    del items[:chunk_size]
+    return normalize_items(chunk) if chunk else None
+
+
+def iter_item_chunks(chunk_size: int) -> Iterator[pd.DataFrame]:
+    """商品の一覧を、chunk_size件ずつのDataFrameにして返すジェネレータ
+
+    ページの取得は fetch_catalog_chunk の段階として計測する
+
+    Args:
+        chunk_size (int): 1回に返す商品数
+
+    Yields:
+        pd.DataFrame: normalize_items で必要な列のみにした商品一覧
+    """
+    pages = iter_item_pages()
+    items = []
+    while (df_chunk := fetch_catalog_chunk(pages, items, chunk_size)) is not None:
+        yield df_chunk
 
 
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """価格・SKU数・割引タイプを、メモリの少ない型に変換する"""
+    dtypes = {"price": "int32", "sku_number": "int32", "discount_type": "category"}
+    return df.astype({key: value for key, value in dtypes.items() if key in df})
+
+
+@run_metrics.stage("prefix_df")
 def prefix_df(df: pd.DataFrame) -> pd.DataFrame:
     """DataFrameの前処理。名前変更。
     メモリ節約のため、非破壊操作。
@@ -64,173 +215,134 @@ def prefix_df(df: pd.DataFrame) -> pd.DataFrame:
         df (pd.DataFrame): 楽天ItemAPIで取得した商品一覧のDataFrame
     """
     # 価格情報と商品名、商品管理番号のみ抽出
-    df_1 = df[["item.manageNumber", "item.title"]]
-    df_2 = df.filter(like="standardPrice", axis="columns")
-    df_necessary = pd.concat([df_1, df_2], axis="columns").fillna("")
-    df_necessary["combined"] = df_necessary.iloc[:, 2:].apply(
-        lambda x: ",".join(x.astype(str)), axis=1
+    df_necessary = df[["item.manageNumber", "item.title"]].copy()
+    # SKUごとの価格を列方向にまとめて数値化（空のSKUはNaN）
+    prices = df.filter(like="standardPrice", axis="columns").apply(
+        pd.to_numeric, errors="coerce"
     )
-    # 価格情報の取得
-    df_necessary.insert(0, "price", 0)
-    for index, row in df_necessary.iterrows():
-        s = row["combined"]
-        # ステップ1: カンマで分割してリストに変換
-        numbers_str_list = s.split(",")
-        # ステップ2: 空の要素を除去
-        numbers_str_list = [num for num in numbers_str_list if num]
-        # SKUのバリエーションによって、商品名が異なるため
-        # 重複しない要素の個数を判定して、格納
-        c = collections.Counter(numbers_str_list)
-        df_necessary.loc[index, "sku_number"] = len(c)
-        # ステップ3: 各要素を整数型に変換
-        numbers = [int(num) for num in numbers_str_list]
-        # ステップ4: min関数を使用して最小値を見つける
-        df_necessary.loc[index, "price"] = min(numbers)
+    # 価格情報の取得。SKUの最小価格を商品の価格とする
+    df_necessary["price"] = prices.min(axis="columns").astype("int64")
+    # SKUのバリエーションによって、商品名が異なるため
+    # 重複しない価格の個数を判定して、格納
+    # 行ごとに並べ替え、直前の値と異なる要素の数を数える（NaNは末尾に並ぶ）
+    sorted_prices = np.sort(prices.to_numpy(dtype="float64"), axis=1)
+    is_new_value = ~np.isnan(sorted_prices)
+    is_new_value[:, 1:] &= sorted_prices[:, 1:] != sorted_prices[:, :-1]
+    df_necessary["sku_number"] = is_new_value.sum(axis=1).astype("float64")
 
     return df_necessary.loc[
         :, ["item.manageNumber", "item.title", "price", "sku_number"]
     ]
-    ############################
-    # df_necessary = df_necessary.loc[:0, :]
-    ############################
-
-
-def extract_coupon_info(root_all_item: ET.Element) -> pd.DataFrame:
-    # クーポンコード
-    coupon_code_list = []
-    for value in root_all_item.iter("couponCode"):
-        coupon_code_list.append(value.text)
-    coupon_code_list.pop(0)
-    # 商品タイプ。4だと、すべての商品に反映可能なクーポン
-    itemtype_list = []
-    for value in root_all_item.iter("itemType"):
-        itemtype_list.append(value.text)
-    # クーポンの開始日時
-    start_date_list = []
-    for value in root_all_item.iter("couponStartDate"):
-        start_date_list.append(value.text)
-    start_date_list.pop(0)
-    # クーポンの終了日時
-    end_date_list = []
-    for value in root_all_item.iter("couponEndDate"):
-        end_date_list.append(value.text)
-    end_date_list.pop(0)
-    # クーポンタイプ（割引なのか、値引きなのか）も取得
-    coupont_type_list = []
-    for value in root_all_item.iter("discountType"):
-        coupont_type_list.append(value.text)
-    # クーポンの割引額
-    discount_list = []
-    for value in root_all_item.iter("discountFactor"):
-        discount_list.append(value.text)
-    data_all_item = {
-        "coupon_code": coupon_code_list,
-        "item_type": itemtype_list,
-        "start_date": start_date_list,
-        "end_date": end_date_list,
-        "discount": discount_list,
-        "coupon_type": coupont_type_list,
-    }
-    return pd.DataFrame(data_all_item)
-
-
-def extract_coupon_condition(root_each_item: ET.Element) -> pd.DataFrame:
-    # クーポンの適用タイプ
-    condition_type = []
-    for value in root_each_item.iter("conditionTypeCode"):
-        condition_type.append(value.text)
-    # クーポンの適用条件
-    condition_value = []
-    for value in root_each_item.iter("startValue"):
-        condition_value.append(value.text)
-    data_each_item = {
-        "condition_type": condition_type,
-        "condition_value": condition_value,
-    }
-    return pd.DataFrame(data_each_item)
-
-
-def extract_coupon_by_item(root: ET.Element) -> pd.DataFrame:
-    # クーポンコード
-    coupon_code_list = []
-    for value in root.iter("couponCode"):
-        coupon_code_list.append(value.text)
-    coupon_code_list.pop(0)
-    # クーポンの開始日時
-    start_date_list = []
-    for value in root.iter("couponStartDate"):
-        start_date_list.append(value.text)
-    start_date_list.pop(0)
-    # クーポンの終了日時
-    end_date_list = []
-    for value in root.iter("couponEndDate"):
-        end_date_list.append(value.text)
-    end_date_list.pop(0)
-    # クーポンタイプ（割引なのか、値引きなのか）も取得
-    coupont_type_list = []
-    for value in root.iter("discountType"):
-        coupont_type_list.append(value.text)
-    # クーポンの割引額
-    discount_list = []
-    for value in root.iter("discountFactor"):
-        discount_list.append(value.text)
-    # クーポンがない時のエラー対応のため、適当な値を格納
-    if len(discount_list) == 0:
-        coupon_code_list.append("")
-        start_date_list.append("2024-01-01T00:00:00+09:00")
-        end_date_list.append("2024-01-01T00:00:00+09:00")
-        discount_list.append(0)
-        coupont_type_list.append(1)
-    # lists to dict to dataframe
-    data = {
-        "coupon_code": coupon_code_list,
-        "start_date": start_date_list,
-        "end_date": end_date_list,
-        "discount": discount_list,
-        "coupon_type": coupont_type_list,
-    }
-    return pd.DataFrame(data)
 
 
+def sync_catalog() -> pd.DataFrame:
+    """前処理済みの商品一覧を取得する
+
+    CATALOG_SYNC_MODE が incremental の時は、保存済みのスナップショットに
+    前回の同期以降に更新された商品だけを取得して反映する。
+    スナップショットがない時、古すぎる時は全件を取得し直す
+    （削除・非表示になった商品は差分では分からないため、定期的に全件取得する）
+    """
+    if CATALOG_SYNC_MODE != "incremental":
+        return prefix_df(get_item_list())
+
+    JST = ZoneInfo("Asia/Tokyo")
+    now = datetime.now(tz=JST)
+    snapshot = CatalogSnapshot(CATALOG_SNAPSHOT_PATH)
+    loaded = snapshot.load()
+    if loaded is None or now - loaded[2] > timedelta(days=CATALOG_FULL_REFRESH_DAYS):
+        df_items = prefix_df(get_item_list())
+        full_synced_at = now
+        print(f"商品一覧を全件取得: {len(df_items)}件")
+    else:
+        df_items, synced_at, full_synced_at = loaded
+        # 時計のずれや、同期中の更新を取りこぼさないよう少し前から取得
+        df_changed = get_item_list(updated_from=synced_at - timedelta(minutes=10))
+        if len(df_changed) > 0:
+            df_items = merge_catalog(df_items, prefix_df(df_changed))
+        print(f"商品一覧を差分取得: 更新{len(df_changed)}件 / 全{len(df_items)}件")
+    snapshot.save(df_items, now, full_synced_at)
+    return df_items
+
+
+def extract_coupon_info(content: bytes) -> pd.DataFrame:
+    """coupon/search のレスポンスから、クーポンの一覧を取り出す
+
+    Args:
+        content (bytes): APIのレスポンスボディ
+    """
+    # itemType: 商品タイプ。4だと、すべての商品に反映可能なクーポン
+    # coupon_type: クーポンタイプ（割引なのか、値引きなのか）
+    return pd.DataFrame(parse_coupon_response(content).coupons)
+
+
+def extract_coupon_condition(content: bytes) -> pd.DataFrame:
+    """coupon/get のレスポンスから、クーポンの適用タイプと適用条件を取り出す
+
+    Args:
+        content (bytes): APIのレスポンスボディ
+    """
+    conditions = parse_coupon_response(content).conditions
+    return pd.DataFrame(
+        {
+            "condition_type": conditions["condition_type"],
+            "condition_value": conditions["condition_value"],
+        }
+    )
+
+
+def extract_coupon_by_item(content: bytes) -> pd.DataFrame:
+    """商品管理番号で絞り込んだ coupon/search のレスポンスから、クーポンの一覧を取り出す
+
+    Args:
+        content (bytes): APIのレスポンスボディ
+    """
+    coupons = parse_coupon_response(content).coupons
+    del coupons["item_type"]
+    # クーポンがない時のエラー対応のため、適当な値を格納
+    if len(coupons["coupon_code"]) == 0:
+        coupons = {
+            "coupon_code": [""],
+            "start_date": ["2024-01-01T00:00:00+09:00"],
+            "end_date": ["2024-01-01T00:00:00+09:00"],
+            "discount": [0],
+            "coupon_type": [1],
+        }
+    return pd.DataFrame(coupons)
+
+
+@run_metrics.stage("get_common_coupon")
 def get_common_coupon() -> pd.DataFrame:
     # 全クーポン情報を取得して、全品に適用できるクーポンを抽出
-    response_all_coupon = requests.get(
-        url=(
-            f"https://api.rms.rakuten.co.jp/es/1.0/coupon/search?hits={hits_limit}&page=1"
-        ),
-        headers=headers,
-    )
-    root_all_item = ET.fromstring(response_all_coupon.content.decode("utf-8"))
-    coupon_df_all_item = extract_coupon_info(root_all_item)
+    response_all_coupon = rms.get(f"/1.0/coupon/search?hits={hits_limit}&page=1")
+    response_all_coupon.raise_for_status()
+    first_page = parse_coupon_response(response_all_coupon.content)
+    coupon_df_all_item = pd.DataFrame(first_page.coupons)
 
     # 合計クーポン数を結果から取得
-    for value in root_all_item.iter("allCount"):
-        count_coupons = int(value.text)
+    count_coupons = first_page.all_count
     page_index = 2
     # クーポンの合計数だけAPIを繰り返す
-    while page_index <= round(count_coupons / hits_limit, 0):
-        response_all_coupon = requests.get(
-            url=(
-                f"https://api.rms.rakuten.co.jp/es/1.0/coupon/search?hits={hits_limit}&page={page_index}"
-            ),
-            headers=headers,
+    while page_index <= math.ceil(count_coupons / hits_limit):
+        response_all_coupon = rms.get(
+            f"/1.0/coupon/search?hits={hits_limit}&page={page_index}"
         )
-        root_all_item = ET.fromstring(response_all_coupon.content.decode("utf-8"))
+        response_all_coupon.raise_for_status()
         coupon_df_all_item = pd.concat(
-            [coupon_df_all_item, extract_coupon_info(root_all_item)]
+            [coupon_df_all_item, extract_coupon_info(response_all_coupon.content)]
         )
 
         page_index += 1
 
-    # 今日適用できるクーポンのみ抽出
+    # 終了していないクーポンのみ抽出。開始前のクーポンも試算（SIMULATION_SNAPSHOT_DIR）で
+    # 使うため残し、今日適用できるかは CouponIndex で判定する
     JST = ZoneInfo("Asia/Tokyo")
     today = datetime.now(tz=JST)
 
     coupon_df_all_item["start_date"] = pd.to_datetime(coupon_df_all_item["start_date"])
     coupon_df_all_item["end_date"] = pd.to_datetime(coupon_df_all_item["end_date"])
-    coupon_df_all_item[
-        (coupon_df_all_item["start_date"] < pd.to_datetime(today))
-        & (coupon_df_all_item["end_date"] > pd.to_datetime(today))
+    coupon_df_all_item = coupon_df_all_item[
+        coupon_df_all_item["end_date"] > pd.to_datetime(today)
     ].reset_index(drop=True)
 
     # すべての商品に適用可能なクーポンのみ抽出
@@ -242,35 +354,47 @@ def get_common_coupon() -> pd.DataFrame:
     ]
 
     # 各クーポンの適用条件を取得
-    temp_coupon_df = pd.DataFrame()
-    for _, row in coupon_df_all_item.iterrows():
-        response_each_coupon = requests.get(
-            url=(
-                "https://api.rms.rakuten.co.jp/es/1.0/coupon/get?couponCode="
-                + row["coupon_code"]
+    # 適用条件はクーポンごとに変わらないため、キャッシュにないクーポンのみAPIを呼ぶ
+    cache = CouponConditionCache(COUPON_CACHE_PATH)
+    cache.purge(today)
+
+    def get_coupon_condition(coupon: tuple) -> pd.DataFrame:
+        coupon_code, end_date = coupon
+        conditions = cache.get(coupon_code)
+        if conditions is None:
+            response_each_coupon = rms.get(f"/1.0/coupon/get?couponCode={coupon_code}")
+            response_each_coupon.raise_for_status()
+            coupon_df_each_item = extract_coupon_condition(response_each_coupon.content)
+
+            # RS003： 利用金額　の条件があるクーポンのみを抽出
+            coupon_df_each_item = coupon_df_each_item[
+                coupon_df_each_item["condition_type"] == "RS003"
+            ]
+            conditions = coupon_df_each_item.values.tolist()
+            cache.put(coupon_code, conditions, end_date)
+        if len(conditions) > 0:
+            return pd.DataFrame(
+                conditions, columns=["condition_type", "condition_value"]
+            ).assign(coupon_code=coupon_code)
+        temp_data = {
+            "condition_type": "",
+            "condition_value": 0,
+            "coupon_code": coupon_code,
+        }
+        return pd.Series(temp_data).to_frame().T
+
+    # sleepを挟まず、レート制限の範囲で並列に取得
+    # 終了していない全品対象のクーポンがない日も、列をそろえて結合できるようにする
+    temp_coupon_df = pd.concat(
+        [pd.DataFrame(columns=["condition_type", "condition_value", "coupon_code"])]
+        + rms.map(
+            get_coupon_condition,
+            coupon_df_all_item[["coupon_code", "end_date"]].itertuples(
+                index=False, name=None
             ),
-            headers=headers,
         )
-        root_each_item = ET.fromstring(response_each_coupon.content.decode("utf-8"))
-        coupon_df_each_item = extract_coupon_condition(root_each_item)
-
-        # RS003： 利用金額　の条件があるクーポンのみを抽出
-        coupon_df_each_item = coupon_df_each_item[
-            coupon_df_each_item["condition_type"] == "RS003"
-        ]
-        if len(coupon_df_each_item) > 0:
-            coupon_df_each_item.loc[:, "coupon_code"] = row["coupon_code"]
-            temp_coupon_df = pd.concat([temp_coupon_df, coupon_df_each_item])
-        else:
-            temp_data = {
-                "condition_type": "",
-                "condition_value": 0,
-                "coupon_code": row["coupon_code"],
-            }
-            temp_coupon_df = pd.concat(
-                [temp_coupon_df, pd.Series(temp_data).to_frame().T]
-            )
-        sleep(1)
+    )
+    print(cache.report())
     coupon_df_all_item = (
         coupon_df_all_item.set_index(keys="coupon_code")
         .join(temp_coupon_df.set_index(keys="coupon_code"))
@@ -279,226 +403,538 @@ def get_common_coupon() -> pd.DataFrame:
     return coupon_df_all_item
 
 
+@run_metrics.stage("get_item_coupons")
+def get_item_coupons(manage_numbers: list) -> pd.DataFrame:
+    """商品管理番号ごとのクーポンを並列に取得し、1つの表にまとめる
+
+    Args:
+        manage_numbers (list): クーポンを取得する商品管理番号
+
+    Returns:
+        pd.DataFrame: 商品管理番号の列を持つ、すべての商品のクーポン情報
+    """
+    coupon_endpoint = "/1.0/coupon/search"
+
+    def get_coupon(manage_number: str) -> pd.DataFrame:
+        response = rms.get(coupon_endpoint, params={"itemUrl": manage_number})
+        # エラーの本文を「クーポンなし」として読むと【】を外した商品名を送ってしまうため、
+        # 再試行してもエラーの時は実行を止め、次の実行でチェックポイントから再開する
+        response.raise_for_status()
+        return extract_coupon_by_item(response.content).assign(
+            **{"item.manageNumber": manage_number}
+        )
+
+    columns = ["item.manageNumber", "coupon_code", "start_date", "end_date"]
+    columns += ["discount", "coupon_type"]
+    return pd.concat(
+        [pd.DataFrame(columns=columns)] + rms.map(get_coupon, manage_numbers),
+        ignore_index=True,
+    )
+
+
+def find_brackets(df_necessary: pd.DataFrame) -> pd.Series:
+    """【】があるかないかの判定＝クーポン情報を反映するかどうかの判定"""
+    return has_brackets(df_necessary["item.title"])
+
+
+@run_metrics.stage("get_coupon_by_item")
 def get_coupon_by_item(
-    df_necessary: pd.DataFrame, coupon_df_all_item: pd.DataFrame
+    df_necessary: pd.DataFrame,
+    common_index: CouponIndex,
+    item_coupon_df: pd.DataFrame | None = None,
 ) -> pd.DataFrame:
-    # 商品管理番号を指定してクーポン情報の取得
-    coupon_endpoint = "https://api.rms.rakuten.co.jp/es/1.0/coupon/search"
+    """クーポン情報から、各商品の新しい商品名を決める
+
+    Args:
+        df_necessary (pd.DataFrame): prefix_df で前処理した商品一覧
+        common_index (CouponIndex): 全品に適用できるクーポンの索引。
+            実行ごとに1回作り、チャンク・シャードの間で使い回す
+        item_coupon_df (pd.DataFrame | None): get_item_coupons で取得済みの
+            商品ごとのクーポン。Noneの時はここで取得する
+    """
     # 今日の日付
     JST = ZoneInfo("Asia/Tokyo")
     today = datetime.now(tz=JST)
-    for index, row in df_necessary.iterrows():
-
-        # 【】があるかないかの判定＝クーポン情報を反映するかどうかの判定
-        def has_brackets(text):
-            # 正規表現パターンを定義
-            pattern = re.compile(r"【[^】]*】")
-            # パターンにマッチするかどうかをチェック
-            match = pattern.search(text)
-            return match is not None
-
-        old_title = ""
-        if has_brackets(row["item.title"]):
-            old_title = re.sub(r"^【[^】]*】", "", row["item.title"])
-        else:
-            df_necessary.loc[index, "new_name"] = row["item.title"]
-            continue
 
-        ### クーポン情報の取得＋整理 ###
-        response = requests.get(
-            url=(coupon_endpoint + "?itemUrl=" + row["item.manageNumber"]),
-            headers=headers,
+    bracketed = find_brackets(df_necessary)
+
+    ### クーポン情報の取得＋整理 ###
+    # 【】がある商品のクーポンだけを並列に取得し、日付の変換は全商品まとめて1回で行う
+    if item_coupon_df is None:
+        item_coupon_df = get_item_coupons(
+            df_necessary.loc[bracketed, "item.manageNumber"]
         )
-        root = ET.fromstring(response.content.decode("utf-8"))
-        coupon_df = extract_coupon_by_item(root)
+    item_index = CouponIndex(item_coupon_df)
+    ### クーポン情報を整理完了 ###
+
+    ### 条件から、適切なクーポンを抽出 ###
+    # 今日有効なクーポンのみを、全品に適用できるクーポンと合わせて全商品分まとめて選び、
+    # 新しい商品名を決める（simulation.py の試算と同じ処理）
+    evaluate_titles(
+        df_necessary,
+        item_index.valid_at(today),
+        common_index.valid_at(today),
+        today,
+    )
+
+    print("====新しい商品名への変更完了====")
+
+    return df_necessary
+
+
+def select_changed_items(df: pd.DataFrame) -> pd.DataFrame:
+    """商品名が実際に変わる商品のみ抽出する
+
+    同じ日の再開した実行で変更済みの商品は、呼び出し元がチェックポイントで除く
+
+    Args:
+        df (pd.DataFrame): item.manageNumber、item.title、new_name を持つDataFrame
+    """
+    changed = df["new_name"].notna() & (df["new_name"] != df["item.title"])
+    return df[changed]
+
+
+# upsert_items の結果の列
+RESULT_COLUMNS = [
+    "item.manageNumber",
+    "result",
+    "status_code",
+    "latency_seconds",
+    "attempts",
+    "error",
+]
+
+
+@run_metrics.stage("upsert_items")
+def upsert_items(
+    df: pd.DataFrame,
+    on_success: Callable[[str], None] | None = None,
+) -> pd.DataFrame:
+    """新しい商品名をPATCHする。商品名が変わらない商品は送らない
+
+    同時に送る数は rms が429・5xx・応答の遅れに応じて調整し、
+    429・5xx・通信エラーの商品は rms が待ってから再試行する
 
-        # 全品に適用できるクーポン情報も結合
-        coupon_df = pd.concat([coupon_df, coupon_df_all_item], axis="index")
-        coupon_df.loc[:, "condition_value"] = (
-            coupon_df.loc[:, "condition_value"].fillna(0).astype("int")
+    Args:
+        df (pd.DataFrame): item.manageNumber、item.title、new_name を持つDataFrame
+        on_success (Callable[[str], None] | None): 変更が完了した商品管理番号を受け取る関数
+
+    Returns:
+        pd.DataFrame: dfの商品ごとの結果（RESULT_COLUMNS）。result は
+            updated（変更完了）、failed（エラー）、skipped（変更がなく送らなかった）。
+            latency_seconds は再試行を含めた所要時間、attempts は送信した回数
+    """
+    upsert_endpoint = "/2.0/items/manage-numbers/"
+    df_changed = select_changed_items(df)
+
+    def upsert_item(args: tuple) -> dict:
+        index, row = args
+        manage_number = row["item.manageNumber"]
+        started = time.monotonic()
+        try:
+            response = rms.patch(
+                upsert_endpoint + str(manage_number),
+                json={"title": row["new_name"]},
+            )
+        except requests.RequestException as e:
+            # 再試行しても通信エラーの商品は、エラーとして記録して他の商品を続ける
+            print(e)
+            print(f"{index + 1}商品目変更エラー")
+            return {
+                "item.manageNumber": manage_number,
+                "result": "failed",
+                "latency_seconds": time.monotonic() - started,
+                "attempts": getattr(e, "attempts", 1),
+                "error": str(e)[:500],
+            }
+        result = {
+            "item.manageNumber": manage_number,
+            "status_code": response.status_code,
+            "latency_seconds": time.monotonic() - started,
+            "attempts": response.attempts,
+        }
+        if response.status_code == 204:
+            print(f"{index + 1}商品目変更完了")
+            if on_success is not None:
+                on_success(manage_number)
+            return {**result, "result": "updated"}
+        # エラーの本文は空のこともあるため、JSONとして読まずにそのまま出す
+        print(response.text[:500])
+        print(f"{index + 1}商品目変更エラー")
+        return {**result, "result": "failed", "error": response.text[:500]}
+
+    # sleepを挟まず、レート制限の範囲で並列に更新
+    results = pd.DataFrame(
+        rms.map(upsert_item, df_changed.iterrows()), columns=RESULT_COLUMNS
+    )
+    skipped = df.loc[~df.index.isin(df_changed.index), ["item.manageNumber"]]
+    skipped = skipped.assign(result="skipped").reindex(columns=RESULT_COLUMNS)
+    results = pd.concat(
+        [frame for frame in (results, skipped) if len(frame) > 0], ignore_index=True
+    ).reindex(columns=RESULT_COLUMNS)
+    results = results.astype({"status_code": "Int64", "attempts": "Int64"})
+    counts = count_results(results)
+    print(
+        f"商品名の変更: 送信{counts['sent']}件 / 変更なし{counts['skipped']}件 "
+        f"/ エラー{counts['failed']}件 / 同時実行数{rms.concurrency.limit:.1f}"
+    )
+    return results
+
+
+def count_results(results: pd.DataFrame) -> dict:
+    """upsert_items の結果の件数
+
+    Returns:
+        dict: 送信した件数（sent）、変更がなく送らなかった件数（skipped）、
+            エラーになった件数（failed）、そのうち429・5xx・通信エラーで、
+            時間をおけば成功しうる件数（retryable）
+    """
+    counts = results["result"].value_counts()
+    failed = results[results["result"] == "failed"]
+    retryable = failed["status_code"].isna() | failed["status_code"].isin(
+        RETRY_STATUS_CODES
+    )
+    return {
+        "sent": int(counts.get("updated", 0) + counts.get("failed", 0)),
+        "skipped": int(counts.get("skipped", 0)),
+        "failed": int(counts.get("failed", 0)),
+        "retryable": int(retryable.sum()),
+    }
+
+
+def attach_results(df: pd.DataFrame, results: pd.DataFrame) -> pd.DataFrame:
+    """監査ログ用に、get_coupon_by_item の結果へ upsert_items の結果を商品ごとに付ける
+
+    前回までに変更が完了して今回送らなかった商品は、結果の列を空にする
+    """
+    return df.merge(results, on="item.manageNumber", how="left")
+
+
+def run_full(checkpoint: Checkpoint) -> dict:
+    """全商品をまとめて処理する。段階ごとの結果をチェックポイントに保存する
+
+    Returns:
+        dict: upsert_items の件数
+    """
+    df_items = checkpoint.stage("catalog", sync_catalog)
+    coupon_df_all_item = checkpoint.stage("common_coupon", get_common_coupon)
+    item_coupon_df = checkpoint.stage(
+        "item_coupon",
+        lambda: get_item_coupons(
+            df_items.loc[find_brackets(df_items), "item.manageNumber"]
+        ),
+    )
+    if SIMULATION_SNAPSHOT_DIR:
+        save_snapshot(
+            SIMULATION_SNAPSHOT_DIR, df_items, coupon_df_all_item, item_coupon_df
+        )
+    df_new_name_by_item = checkpoint.stage(
+        "new_name",
+        lambda: get_coupon_by_item(
+            df_items, CouponIndex(coupon_df_all_item), item_coupon_df
+        ),
+    )
+    # 前回までに変更が完了した商品は飛ばす
+    done_items = checkpoint.done_items()
+    results = upsert_items(
+        df_new_name_by_item[~df_new_name_by_item["item.manageNumber"].isin(done_items)],
+        on_success=checkpoint.mark_item_done,
+    )
+    audit = open_audit_sink(checkpoint)
+    if audit is not None:
+        audit.write(attach_results(df_new_name_by_item, results))
+        close_audit_sink(audit, checkpoint)
+    return count_results(results)
+
+
+def run_chunked(checkpoint: Checkpoint) -> dict:
+    """商品一覧をCHUNK_SIZE件ずつ、取得から変更・BigQueryへの書き込みまで処理する
+
+    メモリに持つのは全品対象のクーポンと、処理中の1チャンク分のみ。
+    商品一覧は毎回全件を取得する（CATALOG_SYNC_MODE は使わない）
+
+    Returns:
+        dict: upsert_items の件数の合計
+    """
+    common_index = CouponIndex(checkpoint.stage("common_coupon", get_common_coupon))
+    done_items = checkpoint.done_items()
+    audit = open_audit_sink(checkpoint)
+    counts = {"sent": 0, "skipped": 0, "failed": 0, "retryable": 0}
+    for df_chunk in iter_item_chunks(CHUNK_SIZE):
+        df_items = compact_dtypes(prefix_df(df_chunk))
+        del df_chunk
+        df_new_name = compact_dtypes(get_coupon_by_item(df_items, common_index))
+        results = upsert_items(
+            df_new_name[~df_new_name["item.manageNumber"].isin(done_items)],
+            on_success=checkpoint.mark_item_done,
         )
-        ### クーポン情報をDataFrameに格納完了 ###
-
-        ### 条件から、適切なクーポンを抽出 ###
-        # 今日の日付を満たすクーポンがある？
-        coupon_df["start_date"] = pd.to_datetime(coupon_df["start_date"])
-        coupon_df["end_date"] = pd.to_datetime(coupon_df["end_date"])
-        available_coupon_df = coupon_df[
-            (coupon_df["start_date"] < pd.to_datetime(today))
-            & (coupon_df["end_date"] > pd.to_datetime(today))
-        ]
-        # 割引後の値段が最も大きいクーポンを選んでいく
-        available_coupon_df.loc[:, "discount"] = available_coupon_df["discount"].astype(
-            "int32"
+        chunk_counts = count_results(results)
+        for key in counts:
+            counts[key] += chunk_counts[key]
+        if audit is not None:
+            audit.write(attach_results(df_new_name, results))
+    if audit is not None:
+        close_audit_sink(audit, checkpoint)
+    print(
+        f"商品名の変更（合計）: 送信{counts['sent']}件 / 変更なし{counts['skipped']}件 "
+        f"/ エラー{counts['failed']}件"
+    )
+    return counts
+
+
+def frame_to_json(df: pd.DataFrame) -> dict:
+    """ワーカーとの受け渡し用に、DataFrameをJSONにできる形（列名と行）にする"""
+    return json.loads(
+        df.to_json(orient="split", index=False, date_format="iso", force_ascii=False)
+    )
+
+
+def frame_from_json(data: dict) -> pd.DataFrame:
+    """frame_to_json の逆変換"""
+    return pd.DataFrame(data["data"], columns=data["columns"])
+
+
+def split_shards(
+    df_items: pd.DataFrame,
+    coupon_df_all_item: pd.DataFrame,
+    done_items: set,
+    shard_count: int,
+) -> list:
+    """商品をshard_count個に分け、ワーカーに渡すリクエストを作る
+
+    【】のある商品が偏らないよう、商品を順番に各シャードへ振り分ける。
+    1秒あたりのリクエスト上限は、全体で rms の上限を超えないようシャードの数で等分する
+
+    Args:
+        df_items (pd.DataFrame): prefix_df で前処理した商品一覧
+        coupon_df_all_item (pd.DataFrame): 全品に適用できるクーポン
+        done_items (set): 前回までに変更が完了した商品管理番号
+        shard_count (int): シャードの数
+
+    Returns:
+        list: シャードごとの run_shard の引数
+    """
+    common_coupons = frame_to_json(coupon_df_all_item)
+    payloads = []
+    for number in range(shard_count):
+        df_shard = df_items.iloc[number::shard_count]
+        payloads.append(
+            {
+                "run_id": run_metrics.run_id,
+                "shard": number,
+                "max_rps": rms.limiter.rate / shard_count,
+                "items": frame_to_json(df_shard),
+                "common_coupons": common_coupons,
+                "done_items": sorted(done_items & set(df_shard["item.manageNumber"])),
+            }
         )
-        available_coupon_df = available_coupon_df.reset_index(drop=True)
+    return payloads
 
-        # 該当するクーポンがないとき
-        if len(available_coupon_df) < 1:
-            df_necessary.loc[index, "discount"] = 0
-            df_necessary.loc[index, "discount_type"] = 0
-            df_necessary.loc[index, "discount_price"] = 0
-        else:
-            # それぞれのクーポンを適用すると、いくらになるのか
-            for tmp_index, tmp_row in available_coupon_df.iterrows():
-                # 定額値引きのクーポン
-                if tmp_row["coupon_type"] == "1":
-                    available_coupon_df.loc[tmp_index, "discounted_price"] = (
-                        df_necessary.loc[index, "price"] - tmp_row["discount"]
-                    )
-                # 定率値引きのクーポン
-                elif tmp_row["coupon_type"] == "2":
-                    available_coupon_df.loc[tmp_index, "discounted_price"] = (
-                        df_necessary.loc[index, "price"]
-                        * (100 - tmp_row["discount"])
-                        / 100
-                    )
-                # 上記以外は割引なしの値段に
-                else:
-                    available_coupon_df.loc[tmp_index, "discounted_price"] = (
-                        df_necessary.loc[index, "price"]
-                    )
-            # 割引後の価格を小さい順に並べ替え
-            ordereded_available_coupon_df = available_coupon_df.sort_values(
-                by=["discounted_price"]
+
+def run_shard(payload: dict) -> dict:
+    """1つのシャードの商品について、クーポンの選択から商品名の変更までを行う
+
+    Args:
+        payload (dict): split_shards で作ったリクエスト
+
+    Returns:
+        dict: upsert_items の件数（counts）、変更が完了した商品管理番号（done_items）、
+            upsert_items の結果を付けた get_coupon_by_item の結果（new_names）
+    """
+    run_metrics.start(f"{payload['run_id']}-{payload['shard']}")
+    rms.set_max_rps(payload["max_rps"])
+    df_items = frame_from_json(payload["items"])
+    df_new_name = get_coupon_by_item(
+        df_items, CouponIndex(frame_from_json(payload["common_coupons"]))
+    )
+    done_items = []
+    results = upsert_items(
+        df_new_name[~df_new_name["item.manageNumber"].isin(payload["done_items"])],
+        on_success=done_items.append,
+    )
+    return {
+        "shard": payload["shard"],
+        "counts": count_results(results),
+        "done_items": done_items,
+        "new_names": frame_to_json(attach_results(df_new_name, results)),
+    }
+
+
+def dispatch_shards(payloads: list) -> list:
+    """シャードをワーカー関数（WORKER_URL）か、ローカルのプロセスで並列に処理する
+
+    Returns:
+        list: シャードごとの run_shard の結果。失敗したシャードは例外
+    """
+    if WORKER_URL:
+        # ワーカー関数は認証が必要なため、IDトークンを付けて呼び出す
+        # （sharded の時しか使わないため、ここで読み込む）
+        from google.auth.transport.requests import Request
+        from google.oauth2 import id_token
+
+        token = id_token.fetch_id_token(Request(), WORKER_URL)
+
+        def post(payload: dict) -> dict:
+            response = requests.post(
+                WORKER_URL,
+                json=payload,
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=3600,
             )
-            # クーポンの適用条件を満たしているチェック
-            # 実質価格が小さいものから適用条件をチェックして、breakするような処理
-            is_available = False
-            for i, r in ordereded_available_coupon_df.iterrows():
-                if r["condition_value"] <= df_necessary.loc[index, "price"]:
-                    df_necessary.loc[index, "discount"] = available_coupon_df.loc[
-                        i, "discount"
-                    ]
-                    df_necessary.loc[index, "discount_type"] = available_coupon_df.loc[
-                        i, "coupon_type"
-                    ]
-                    df_necessary.loc[index, "discount_price"] = available_coupon_df.loc[
-                        i, "discounted_price"
-                    ]
-                    is_available = True
-                    break
-                else:
-                    print("クーポンの適用条件を満たさない！次のクーポンをチェック！")
-            # 最終的に条件を満たしているクーポンがあったかどうかの判定。適用クーポンがなければ、割引をすべて0で挿入
-            if is_available == False:
-                df_necessary.loc[index, "discount"] = 0
-                df_necessary.loc[index, "discount_type"] = 0
-                df_necessary.loc[index, "discount_price"] = 0
-
-        ### 適切なクーポン情報を取得完了 ###
-
-        ### 商品名の変更を開始 ###
-        # 型変換
-        old_price = int(df_necessary.loc[index, "price"])
-        discount_price = int(df_necessary.loc[index, "discount_price"])
-        discount = df_necessary.loc[index, "discount"]
-        ## 定額値引きのクーポンが最大割引の場合の新しい商品名
-        if df_necessary.loc[index, "discount_type"] == "1":
-            ## SKUの数によって場合分け
-            if old_price / discount_price >= 2:
-                df_necessary.loc[index, "new_name"] = (
-                    f"【クーポンで{old_price:,}円→{int(old_price*0.5):,}円】{old_title}"
-                )
-            else:
-                df_necessary.loc[index, "new_name"] = (
-                    f"【クーポンで{old_price:,}円→{discount_price:,}円】{old_title}"
+            response.raise_for_status()
+            return response.json()
+
+        executor = ThreadPoolExecutor(max_workers=len(payloads))
+        futures = [executor.submit(post, payload) for payload in payloads]
+    else:
+        # fork するとAPIの接続を子プロセスと共有してしまうため、spawn で起動する
+        executor = ProcessPoolExecutor(
+            max_workers=len(payloads), mp_context=multiprocessing.get_context("spawn")
+        )
+        futures = [executor.submit(run_shard, payload) for payload in payloads]
+    with executor:
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+    return results
+
+
+def run_sharded(checkpoint: Checkpoint) -> dict:
+    """商品一覧と全品対象のクーポンを1回だけ取得し、シャードに分けて並列に処理する
+
+    Returns:
+        dict: upsert_items の件数の合計
+    """
+    df_items = checkpoint.stage("catalog", sync_catalog)
+    coupon_df_all_item = checkpoint.stage("common_coupon", get_common_coupon)
+    payloads = split_shards(
+        df_items, coupon_df_all_item, checkpoint.done_items(), SHARD_COUNT
+    )
+    del df_items
+    audit = open_audit_sink(checkpoint)
+    counts = {"sent": 0, "skipped": 0, "failed": 0, "retryable": 0}
+    errors = []
+    for result in dispatch_shards(payloads):
+        if isinstance(result, Exception):
+            errors.append(result)
+            continue
+        for item in result["done_items"]:
+            checkpoint.mark_item_done(item)
+        for key in counts:
+            counts[key] += result["counts"][key]
+        if audit is not None:
+            audit.write(
+                frame_from_json(result["new_names"]).astype(
+                    {"status_code": "Int64", "attempts": "Int64"}
                 )
-        ## 定率値引きのクーポンが最大割引の場合
-        # この時、割引率で場合わけ必要
-        elif df_necessary.loc[index, "discount_type"] == "2":
-            if discount > 50:
-                ## SKUの数によって場合分け
-                if row["sku_number"] > 1:
-                    df_necessary.loc[index, "new_name"] = (
-                        f"【クーポンで{old_price:,}円→{int(old_price*0.5):,}円～】{old_title}"
-                    )
-                elif row["sku_number"] == 1:
-                    df_necessary.loc[index, "new_name"] = (
-                        f"【クーポンで{old_price:,}円→{int(old_price*0.5):,}円】{old_title}"
-                    )
-            elif discount == 50:
-                ## SKUの数によって場合分け
-                if row["sku_number"] > 1:
-                    df_necessary.loc[index, "new_name"] = (
-                        f"【クーポンで{old_price:,}円→{discount_price:,}円～】{old_title}"
-                    )
-                elif row["sku_number"] == 1:
-                    df_necessary.loc[index, "new_name"] = (
-                        f"【クーポンで{old_price:,}円→{discount_price:,}円】{old_title}"
-                    )
-            else:
-                if row["sku_number"] > 1:
-                    df_necessary.loc[index, "new_name"] = (
-                        f"【クーポンで{old_price:,}円→{discount_price:,}円～】{old_title}"
-                    )
-                elif row["sku_number"] == 1:
-                    df_necessary.loc[index, "new_name"] = (
-                        f"【クーポンで{old_price:,}円→{discount_price:,}円】{old_title}"
-                    )
-        # その他
-        else:
-            df_necessary.loc[index, "new_name"] = "{}".format(old_title)
-        # print("{}商品目完了".format(index + 1))
-        # print(df_necessary.loc[index, "new_name"])
+            )
+    if errors:
+        # 完了したシャードの商品はチェックポイントに記録済み。次の実行で残りを処理する
+        raise RuntimeError(f"{len(errors)}シャードの処理に失敗: {errors}")
+    if audit is not None:
+        close_audit_sink(audit, checkpoint)
+    print(
+        f"商品名の変更（合計）: 送信{counts['sent']}件 / 変更なし{counts['skipped']}件 "
+        f"/ エラー{counts['failed']}件"
+    )
+    return counts
 
-    print("====新しい商品名への変更完了====")
 
-    return df_necessary
+def open_audit_sink(checkpoint: Checkpoint) -> AuditSink | None:
+    """監査ログの書き込み先。書き込まない設定の時はNone
 
+    同じ日の再実行では、前回までに結果が確定した商品を除いて書き込む。
+    エラーだった商品は、再試行した結果を書き込む
+    """
+    if not (AUDIT_TABLE or AUDIT_LOCAL_DIR):
+        return None
+    return AuditSink(
+        AUDIT_TABLE,
+        # 前回の実行が途中で落ちて残ったファイルは、上書きする
+        path=os.path.join(tempfile.gettempdir(), "rakuten_title_rename_audit.parquet"),
+        local_dir=AUDIT_LOCAL_DIR,
+        run_id=run_metrics.run_id,
+        partition_date=date.today(),
+        settled_items=checkpoint.audited_items(),
+    )
 
-def upsert_items(df: pd.DataFrame):
-    upsert_endpoint = "https://api.rms.rakuten.co.jp/es/2.0/items/manage-numbers/"
-    for index, row in df.iterrows():
-        response = requests.patch(
-            url=upsert_endpoint + str(row["item.manageNumber"]),
-            headers=headers,
-            json={"title": row["new_name"]},
-        )
-        sleep(1)
-        if response.status_code == 204:
-            print(f"{index + 1}商品目変更完了")
-        else:
-            print(response.json())
-            print(f"{index + 1}商品目変更エラー")
+
+@run_metrics.stage("write_audit")
+def close_audit_sink(audit: AuditSink, checkpoint: Checkpoint):
+    """監査ログの追加を確定する。再開した実行で、同じ商品を二重に追加しない"""
+    audit.close()
+    checkpoint.mark_items_audited(audit.settled_items)
 
 
 def main(argas):
+    JST = ZoneInfo("Asia/Tokyo")
+    run_metrics.start(datetime.now(tz=JST).strftime("%Y%m%d%H%M%S"))
+    # 同じ日の再実行は、チェックポイントから続きを再開する
+    checkpoint = Checkpoint(CHECKPOINT_DIR, datetime.now(tz=JST).strftime("%Y%m%d"))
+    # Cloud Schedulerは応答を待ち切れないと再試行するため、その再試行が
+    # 処理中の実行と並行して動いたり、完了した直後にもう1回全件を処理したりしないようにする
+    if checkpoint.completed_within(RUN_LEASE_SECONDS):
+        print("直前の実行が完了済み")
+        return "200"
+    if not checkpoint.acquire_lease(RUN_LEASE_SECONDS):
+        print("同じ日の実行が処理中")
+        return "同じ日の実行が処理中", 409
     try:
-        df_items = prefix_df(get_item_list())
-        df_new_name_by_item = get_coupon_by_item(df_items, get_common_coupon())
-        # デバッグ用
-        JST = ZoneInfo("Asia/Tokyo")
-        df_new_name_by_item["partition_date"] = date.today()
-        client = bigquery.Client(project="doctor-ilcsi")
-        job_config = bigquery.LoadJobConfig(
-            write_disposition="WRITE_APPEND",
-        )
-        df_new_name_by_item = df_new_name_by_item.astype("str")
-        df_new_name_by_item.columns = df_new_name_by_item.columns.str.replace(".", "_")
-        job = client.load_table_from_dataframe(
-            df_new_name_by_item,
-            "doctor-ilcsi.dl_rakuten_title_renmae.debug",
-            job_config=job_config,
-        )
-        upsert_items(df_new_name_by_item)
+        if PIPELINE_MODE == "chunked":
+            counts = run_chunked(checkpoint)
+        elif PIPELINE_MODE == "sharded":
+            counts = run_sharded(checkpoint)
+        else:
+            counts = run_full(checkpoint)
+        # 商品名が長すぎるなどの4xxは再実行しても失敗するため、監査ログに残して完了とする
+        if counts["retryable"] > 0:
+            raise RuntimeError(f"{counts['retryable']}商品の変更に失敗")
     except Exception as e:
+        # 個々のリクエストはRmsClientで再試行済み。チェックポイントを残して終了し、
+        # 次の実行（Cloud Schedulerの再試行）で続きから再開する
         print(e)
-        sleep(5)
-        print("1st Retry")
-        try:
-            df_items = prefix_df(get_item_list())
-            df_new_name_by_item = get_coupon_by_item(df_items, get_common_coupon())
-            upsert_items(df_new_name_by_item)
-        except:
-            sleep(10)
-            print("2nd Retry")
-            df_items = prefix_df(get_item_list())
-            df_new_name_by_item = get_coupon_by_item(df_items, get_common_coupon())
-            upsert_items(df_new_name_by_item)
+        raise
+    finally:
+        write_run_metrics()
+        checkpoint.release_lease()
+    checkpoint.clear()
     return "200"
 
 
+def worker(request):
+    """シャードを処理するエントリーポイント。PIPELINE_MODE が sharded の main から呼ばれる
+
+    Args:
+        request (flask.Request): split_shards で作ったリクエストをJSONで持つ
+
+    Returns:
+        dict: run_shard の結果
+    """
+    try:
+        return run_shard(request.get_json())
+    finally:
+        write_run_metrics()
+
+
+def write_run_metrics():
+    """実行全体の計測結果をログに出し、指定があればBigQueryにも書き込む"""
+    row = run_metrics.to_row()
+    print(json.dumps({"severity": "INFO", "message": "run_metrics", **row}))
+    if not METRICS_TABLE:
+        return
+    # 計測結果の書き込みに失敗しても、本来の処理の結果は変えない
+    try:
+        client = bigquery_client("doctor-ilcsi")
+        errors = client.insert_rows_json(METRICS_TABLE, [row])
+    except Exception as e:
+        errors = [str(e)]
+    if errors:
+        print(f"計測結果の書き込みエラー: {errors}")
+
+
 # %%
 # df_items = get_item_list()
 # df_items_necessary = prefix_df(df_items)
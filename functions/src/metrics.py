@@ -0,0 +1,181 @@
+"""処理の段階ごとの計測
+
+段階ごとに、経過時間・API呼び出し回数・送受信バイト数・再試行回数・待ち時間・
+段階の中でのピークメモリ・処理件数を記録し、構造化ログ（1行1JSON）として出力する。
+Cloud Loggingでは jsonPayload として検索・集計できる。
+段階の中で別の段階を呼んだ時（get_coupon_by_item の中の get_item_coupons など）は、
+内側の段階の分を外側の段階から除き、段階ごとの値を足すと実行全体の値になるようにする。
+例外で終わった段階も、status を error として記録する。
+"""
+
+import functools
+import json
+import resource
+import time
+from datetime import datetime
+from typing import Callable
+
+import pandas as pd
+
+from rms_client import STAT_KEYS, RmsClient
+
+# ログ出力用の項目。BigQueryに書き込む時は除く
+LOG_KEYS = {"severity", "message", "run_id"}
+# ピークメモリ（VmHWM）を、現在の使用量に戻すためのファイル（Linuxのみ）
+CLEAR_REFS_PATH = "/proc/self/clear_refs"
+STATUS_PATH = "/proc/self/status"
+
+
+def peak_rss_mb() -> float:
+    """ピークメモリ（MiB）。Linuxの ru_maxrss はKiB単位
+
+    reset_peak_rss で戻した後は、戻してからのピーク
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss() -> bool:
+    """ピークメモリを現在の使用量に戻す
+
+    Returns:
+        bool: 戻せたかどうか。Linux以外や、書き込みが許可されていない時はFalse
+    """
+    try:
+        with open(CLEAR_REFS_PATH, "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def hwm_rss_mb() -> float | None:
+    """reset_peak_rss で戻してからのピークメモリ（MiB）。VmHWMはkB単位
+
+    Returns:
+        float | None: 読めない時はNone
+    """
+    try:
+        with open(STATUS_PATH, encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class RunMetrics:
+    """1回の実行の計測結果
+
+    Args:
+        client (RmsClient): API呼び出しの回数などを集計するクライアント
+    """
+
+    def __init__(self, client: RmsClient):
+        self.client = client
+        self.run_id = ""
+        self.started_at = None
+        self.stages = []
+        # 実行中の段階ごとの、内側の段階の経過時間・APIの集計の合計と、ピークメモリの最大
+        self._nested = []
+        # 段階の開始時にピークメモリを戻す前の、プロセス起動からのピーク
+        self._process_peak_rss_mb = 0.0
+
+    def start(self, run_id: str):
+        """実行の開始時に、前回の実行の計測結果を消す"""
+        self.run_id = run_id
+        self.started_at = datetime.now().astimezone()
+        self.stages = []
+        self._nested = []
+
+    def stage(self, name: str) -> Callable:
+        """関数の実行を1つの段階として計測するデコレーター
+
+        処理件数は、戻り値がDataFrameならその行数、それ以外は第1引数の行数。
+        経過時間とAPIの集計は、内側の段階の分を除いた値。
+        peak_rss_mb は段階の中でのピークメモリ（内側の段階の分を含む）。
+        ピークメモリを戻せない環境では、プロセス起動からのピーク
+        """
+
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                before = dict(self.client.stats)
+                started = time.perf_counter()
+                resettable = self._reset_peak_rss()
+                nested = dict.fromkeys(["wall_seconds", *STAT_KEYS, "peak_rss_mb"], 0)
+                self._nested.append(nested)
+                result = None
+                status = "error"
+                try:
+                    result = func(*args, **kwargs)
+                    status = "ok"
+                    return result
+                finally:
+                    self._nested.pop()
+                    total = {"wall_seconds": time.perf_counter() - started}
+                    for key in STAT_KEYS:
+                        total[key] = self.client.stats[key] - before[key]
+                    peak = max(
+                        (hwm_rss_mb() if resettable else None) or peak_rss_mb(),
+                        nested["peak_rss_mb"],
+                    )
+                    # 外側の段階からは、この段階の分を除く。ピークメモリは外側にも含める
+                    if self._nested:
+                        for key, value in total.items():
+                            self._nested[-1][key] += value
+                        self._nested[-1]["peak_rss_mb"] = max(
+                            self._nested[-1]["peak_rss_mb"], peak
+                        )
+                    record = {
+                        "severity": "INFO",
+                        "message": "stage_metrics",
+                        "run_id": self.run_id,
+                        "stage": name,
+                        "status": status,
+                    }
+                    for key, value in total.items():
+                        record[key] = value - nested[key]
+                    record["wall_seconds"] = round(record["wall_seconds"], 3)
+                    record["wait_seconds"] = round(record["wait_seconds"], 3)
+                    record["peak_rss_mb"] = round(peak, 1)
+                    if isinstance(result, pd.DataFrame):
+                        record["rows"] = len(result)
+                    elif args and hasattr(args[0], "__len__"):
+                        record["rows"] = len(args[0])
+                    self.stages.append(record)
+                    print(json.dumps(record, ensure_ascii=False))
+
+            return wrapper
+
+        return decorator
+
+    def _reset_peak_rss(self) -> bool:
+        """段階の開始時にピークメモリを戻す
+
+        戻す前のピークは、実行中の外側の段階と実行全体の値に残す
+        """
+        self._process_peak_rss_mb = max(self._process_peak_rss_mb, peak_rss_mb())
+        hwm = hwm_rss_mb()
+        if self._nested and hwm is not None:
+            self._nested[-1]["peak_rss_mb"] = max(self._nested[-1]["peak_rss_mb"], hwm)
+        return reset_peak_rss()
+
+    def to_row(self) -> dict:
+        """BigQueryに書き込む、1回の実行分の行"""
+        return {
+            "run_id": self.run_id,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "wall_seconds": round(
+                (datetime.now().astimezone() - self.started_at).total_seconds(), 3
+            ),
+            # プロセス起動からのピーク。ウォームスタートでは前回までの実行の分も含む
+            "peak_rss_mb": round(max(self._process_peak_rss_mb, peak_rss_mb()), 1),
+            "stages": json.dumps(
+                [
+                    {key: value for key, value in stage.items() if key not in LOG_KEYS}
+                    for stage in self.stages
+                ],
+                ensure_ascii=False,
+            ),
+        }
@@ -0,0 +1,269 @@
+"""楽天RMS APIの共通クライアント
+
+すべてのAPI呼び出しで1つのセッション（コネクションプール）を共有し、
+トークンバケットで1秒あたりのリクエスト数を制限する。
+同時に送るリクエスト数は、429・5xx・応答の遅れに応じてAIMDで調整する。
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 再試行するステータスコード
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# 1秒の窓ごとに空ける余裕（秒）。送信とサーバーでの受信の時刻のずれで、上限ちょうどに
+# 設定しても直近1秒間のリクエスト数が上限を超え、429になるのを防ぐ
+RATE_MARGIN_SECONDS = 0.05
+# RmsClient.stats の項目。wait_seconds はレート制限と再試行で待った秒数の合計
+STAT_KEYS = ["api_calls", "bytes_sent", "bytes_received", "retries", "wait_seconds"]
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class TokenBucket:
+    """スレッドセーフなトークンバケット
+
+    トークンは (1 + margin) 秒ごとに rate 個補充する。容量が1の時、最初のリクエストから
+    rate + 1 個目のリクエストまでは 1 + margin 秒空くため、どの1秒間にも rate 個までしか送らない
+
+    Args:
+        rate (float): 1秒あたりのリクエスト上限
+        capacity (float): バケットの容量。瞬間的に連続で送れるリクエスト数
+        margin (float): 1秒の窓ごとに空ける余裕（秒）
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0, margin: float = 0.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.margin = margin
+        self._refill_rate = rate / (1 + margin)
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """トークンを1つ取得する。トークンがなければ補充されるまで待つ
+
+        Returns:
+            float: 待った秒数
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated_at) * self._refill_rate,
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self._refill_rate
+            time.sleep(wait)
+            waited += wait
+
+
+class AdaptiveConcurrency:
+    """AIMDで、同時に送るリクエスト数の上限を調整するリミッター
+
+    成功するたびに上限を 1/上限 ずつ増やし（上限と同じ数だけ成功すると1増える）、
+    429・5xx・通信エラーの時や、応答時間がふだんの latency_factor 倍を超えた時は半分にする。
+    同時に送ったリクエストの失敗で何度も減らさないよう、減らすのは応答時間1回分に1回まで
+
+    Args:
+        max_limit (int): 上限の最大値。最初はこの値から始める
+        min_limit (int): 上限の最小値
+        latency_factor (float): 遅れとみなす、ふだんの応答時間に対する倍率
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, latency_factor: float = 3.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.latency_factor = latency_factor
+        self.limit = float(max_limit)
+        self.decreases = 0
+        self._in_flight = 0
+        # 成功したリクエストの応答時間の指数移動平均（ふだんの応答時間）
+        self._latency = None
+        self._decreased_at = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> float:
+        """送信中のリクエスト数が上限より少なくなるまで待つ
+
+        Returns:
+            float: 待った秒数
+        """
+        started = time.monotonic()
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+        return time.monotonic() - started
+
+    def release(self, ok: bool, latency: float):
+        """リクエストの結果から上限を調整する
+
+        Args:
+            ok (bool): 429・5xx・通信エラーでなかったか
+            latency (float): 応答時間（秒）
+        """
+        with self._condition:
+            self._in_flight -= 1
+            slow = self._latency is not None and (
+                latency > self._latency * self.latency_factor
+            )
+            if ok and not slow:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            else:
+                now = time.monotonic()
+                if now - self._decreased_at > (self._latency or 0.0):
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._decreased_at = now
+                    self.decreases += 1
+            if ok:
+                self._latency = (
+                    latency
+                    if self._latency is None
+                    else 0.9 * self._latency + 0.1 * latency
+                )
+            self._condition.notify_all()
+
+
+class RmsClient:
+    """楽天RMS APIのクライアント
+
+    Args:
+        headers (dict | Callable[[], dict]): 認証ヘッダー。関数の時は、
+            最初のリクエストの時に1回だけ呼び出す
+        base_url (str): APIのベースURL
+        max_rps (float): 1秒あたりのリクエスト上限
+        max_workers (int): 同時に実行するリクエスト数の上限。
+            実際の同時実行数は、この範囲で AdaptiveConcurrency が調整する
+        max_retries (int): 429・5xx・通信エラーの時の再試行回数
+        backoff (float): 再試行の待ち時間の初期値（秒）。再試行のたびに2倍にする
+        timeout (float): 1リクエストのタイムアウト（秒）
+    """
+
+    def __init__(
+        self,
+        headers: dict | Callable[[], dict],
+        base_url: str,
+        max_rps: float = 1.0,
+        max_workers: int = 4,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        timeout: float = 60.0,
+    ):
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate=max_rps, margin=RATE_MARGIN_SECONDS)
+        self.concurrency = AdaptiveConcurrency(max_limit=max_workers)
+        # 処理の段階ごとの計測用に、起動からの累計を記録する
+        self.stats = dict.fromkeys(STAT_KEYS, 0)
+        self._stats_lock = threading.Lock()
+        self._headers = headers
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """最初のリクエストの時にセッションを作り、以降は使い回す"""
+        with self._session_lock:
+            if self._session is None:
+                headers = self._headers() if callable(self._headers) else self._headers
+                session = requests.Session()
+                session.headers.update(headers)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+        return self._session
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """レート制限を守ってリクエストを送る
+
+        429・5xx・通信エラーの時は、指数バックオフで待って再試行する。
+        429でRetry-Afterがある時は、その秒数だけ待つ
+
+        Args:
+            method (str): HTTPメソッド
+            path (str): base_url以降のパス
+
+        Returns:
+            requests.Response: 最後のレスポンス。attempts に送信した回数を持つ
+
+        Raises:
+            requests.RequestException: 再試行しても通信エラーの時と、再試行しない例外の時。
+                attempts に送信した回数を持つ
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            # 同時実行数の空きを待ってからトークンを取る。先にトークンを取ると、
+            # 空きを待っていたリクエストが空いた時に一斉に送られ、1秒あたりの上限を超える
+            self._count(wait_seconds=self.concurrency.acquire())
+            self._count(wait_seconds=self.limiter.acquire(), api_calls=1)
+            wait = self.backoff * 2**attempt
+            started = time.monotonic()
+            ok = False
+            try:
+                response = self.session.request(method, self.base_url + path, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    e.attempts = attempt + 1
+                    raise
+            except requests.RequestException as e:
+                e.attempts = attempt + 1
+                raise
+            else:
+                ok = response.status_code not in RETRY_STATUS_CODES
+                response.attempts = attempt + 1
+                self._count(
+                    bytes_sent=len(response.request.body or b""),
+                    bytes_received=len(response.content),
+                )
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                if attempt == self.max_retries:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                if response.status_code == 429 and retry_after:
+                    wait = float(retry_after)
+            finally:
+                # どの例外の時も、同時実行数の枠を必ず返す
+                self.concurrency.release(ok, time.monotonic() - started)
+            self._count(retries=1, wait_seconds=wait)
+            time.sleep(wait)
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def patch(self, path: str, **kwargs) -> requests.Response:
+        return self.request("PATCH", path, **kwargs)
+
+    def set_max_rps(self, max_rps: float):
+        """1秒あたりのリクエスト上限を変更する。全体の上限をシャードごとに分ける時に使う"""
+        self.limiter = TokenBucket(rate=max_rps, margin=RATE_MARGIN_SECONDS)
+
+    def map(self, func: Callable[[T], R], iterable: Iterable[T]) -> list[R]:
+        """funcをmax_workers個まで並列に実行し、入力と同じ順番で結果を返す
+
+        レート制限はfunc内のリクエストごとに掛かるため、
+        sleepを挟まなくても上限を超えることはない
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, iterable))
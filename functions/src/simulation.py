@@ -0,0 +1,198 @@
+"""保存した商品一覧・クーポンでの、新しい商品名の試算
+
+main と同じクーポンの選び方・商品名の決め方（evaluate_titles）で、保存しておいた商品一覧とクーポンから
+任意の日時・クーポンの組み合わせ（シナリオ）の新しい商品名を試算し、
+現在の商品名から変わる商品を一覧にする。APIは呼ばないため、キャンペーンの計画に使える。
+
+    python functions/src/simulation.py --snapshot-dir snapshot \\
+        --scenarios scenarios.json --output report.csv
+
+シナリオのJSONは次の形のリスト。at を省略すると現在の日時
+    [{"name": "11月のセール", "at": "2024-11-01T10:00:00+09:00",
+      "add_coupons": [{"coupon_code": "...", "item.manageNumber": "",
+                       "start_date": "...", "end_date": "...", "discount": 10,
+                       "coupon_type": "2", "condition_value": 0}],
+      "remove_coupons": ["クーポンコード"]}]
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+from coupon_index import SHOP_WIDE, CouponIndex, prepare_coupons
+from title_evaluation import evaluate_titles
+from title_renderer import has_brackets
+
+# 試算結果の一覧の列
+REPORT_COLUMNS = [
+    "scenario",
+    "item.manageNumber",
+    "item.title",
+    "new_name",
+    "price",
+    "discount",
+    "discount_type",
+    "discount_price",
+]
+
+
+def save_snapshot(
+    directory: str,
+    catalog: pd.DataFrame,
+    common_coupons: pd.DataFrame,
+    item_coupons: pd.DataFrame,
+):
+    """試算に使う商品一覧とクーポンを保存する
+
+    クーポンは1つの表にまとめ、全品対象のクーポンの商品管理番号は空文字にする
+
+    Args:
+        directory (str): 保存先のディレクトリ（catalog.parquet、coupons.parquet）
+        catalog (pd.DataFrame): prefix_df で前処理した商品一覧
+        common_coupons (pd.DataFrame): get_common_coupon の結果
+        item_coupons (pd.DataFrame): get_item_coupons の結果
+    """
+    os.makedirs(directory, exist_ok=True)
+    coupons = prepare_coupons(
+        pd.concat(
+            [item_coupons, common_coupons.assign(**{"item.manageNumber": SHOP_WIDE})],
+            ignore_index=True,
+        )
+    )
+    # クーポンがない商品の仮の値は数値のため、Parquetに保存できるよう文字列にそろえる
+    coupons["coupon_type"] = coupons["coupon_type"].astype("str")
+    catalog.to_parquet(os.path.join(directory, "catalog.parquet"), index=False)
+    coupons.to_parquet(os.path.join(directory, "coupons.parquet"), index=False)
+
+
+def load_snapshot(directory: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """save_snapshot で保存した商品一覧とクーポン"""
+    return (
+        pd.read_parquet(os.path.join(directory, "catalog.parquet")),
+        pd.read_parquet(os.path.join(directory, "coupons.parquet")),
+    )
+
+
+class Simulator:
+    """保存した商品一覧とクーポンで、シナリオごとの新しい商品名を試算する
+
+    【】のない商品は商品名が変わらないため、【】のある商品だけを持っておく。
+    クーポンを変えないシナリオでは、クーポンの索引を使い回す
+
+    Args:
+        catalog (pd.DataFrame): prefix_df で前処理した商品一覧
+        coupons (pd.DataFrame): save_snapshot と同じ形のクーポン
+    """
+
+    def __init__(self, catalog: pd.DataFrame, coupons: pd.DataFrame):
+        bracketed = has_brackets(catalog["item.title"])
+        self.items = catalog.loc[
+            bracketed, ["item.manageNumber", "item.title", "price", "sku_number"]
+        ].reset_index(drop=True)
+        self.coupons = coupons
+        self.index = CouponIndex(coupons)
+
+    def run(self, scenario: dict) -> pd.DataFrame:
+        """1つのシナリオの新しい商品名
+
+        Args:
+            scenario (dict): at（日時）、add_coupons（追加するクーポン）、
+                remove_coupons（除くクーポンコード）を持つシナリオ
+
+        Returns:
+            pd.DataFrame: 【】のある商品の、evaluate_titles の結果
+        """
+        index = self.index
+        if scenario.get("add_coupons") or scenario.get("remove_coupons"):
+            coupons = self.coupons[
+                ~self.coupons["coupon_code"].isin(scenario.get("remove_coupons", []))
+            ]
+            added = pd.DataFrame(scenario.get("add_coupons", []))
+            if len(added) > 0:
+                # 商品管理番号のないクーポンは全品対象
+                if "item.manageNumber" not in added.columns:
+                    added["item.manageNumber"] = SHOP_WIDE
+                added["item.manageNumber"] = added["item.manageNumber"].fillna(
+                    SHOP_WIDE
+                )
+                added["coupon_type"] = added["coupon_type"].astype("str")
+                coupons = pd.concat(
+                    [coupons, prepare_coupons(added)], ignore_index=True
+                )
+            index = CouponIndex(coupons)
+
+        if scenario.get("at"):
+            when = pd.Timestamp(scenario["at"]).to_pydatetime()
+        else:
+            when = datetime.now(tz=ZoneInfo("Asia/Tokyo"))
+        valid = index.valid_at(when)
+        shop_wide = (valid["item.manageNumber"] == SHOP_WIDE).to_numpy()
+        return evaluate_titles(
+            self.items.copy(), valid[~shop_wide], valid[shop_wide], when
+        )
+
+    def report(self, scenarios: list) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """シナリオごとに、商品名が変わる商品の一覧と集計を作る
+
+        Args:
+            scenarios (list): run に渡すシナリオのリスト
+
+        Returns:
+            tuple[pd.DataFrame, pd.DataFrame]: 商品名が変わる商品の一覧（REPORT_COLUMNS）と、
+                シナリオごとの件数・処理時間
+        """
+        frames = []
+        summary = []
+        for number, scenario in enumerate(scenarios):
+            name = scenario.get("name", str(number))
+            started = time.perf_counter()
+            result = self.run(scenario)
+            changed = result[
+                result["new_name"].notna()
+                & (result["new_name"] != result["item.title"])
+            ]
+            frames.append(changed.assign(scenario=name)[REPORT_COLUMNS])
+            summary.append(
+                {
+                    "scenario": name,
+                    "items": len(result),
+                    "changed": len(changed),
+                    "seconds": round(time.perf_counter() - started, 3),
+                }
+            )
+        changed_items = [frame for frame in frames if len(frame) > 0]
+        if changed_items:
+            report = pd.concat(changed_items, ignore_index=True)
+        else:
+            report = pd.DataFrame(columns=REPORT_COLUMNS)
+        return report, pd.DataFrame(summary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="新しい商品名の試算")
+    parser.add_argument("--snapshot-dir", required=True, help="save_snapshot の保存先")
+    parser.add_argument(
+        "--catalog",
+        help="商品一覧のParquet（CATALOG_SNAPSHOT_PATH など）。省略時はsnapshot-dirのもの",
+    )
+    parser.add_argument("--scenarios", help="シナリオのJSON。省略時は現在の日時のみ")
+    parser.add_argument("--output", help="商品名が変わる商品の一覧を書き出すCSV")
+    args = parser.parse_args()
+
+    catalog, coupons = load_snapshot(args.snapshot_dir)
+    if args.catalog:
+        catalog = pd.read_parquet(args.catalog)
+    scenarios = [{"name": "now"}]
+    if args.scenarios:
+        with open(args.scenarios, encoding="utf-8") as f:
+            scenarios = json.load(f)
+
+    report, summary = Simulator(catalog, coupons).report(scenarios)
+    print(summary.to_string(index=False))
+    if args.output:
+        report.to_csv(args.output, index=False)
@@ -0,0 +1,37 @@
+"""クーポンから、各商品の割引と新しい商品名を決める処理
+
+main の実行と simulation の試算の両方で使う。APIは呼ばない。
+"""
+
+from datetime import datetime
+
+import pandas as pd
+
+from coupon_selection import select_best_coupon
+from title_renderer import has_brackets, render_titles
+
+
+def evaluate_titles(
+    df_necessary: pd.DataFrame,
+    item_coupons: pd.DataFrame,
+    common_coupons: pd.DataFrame,
+    when: datetime,
+) -> pd.DataFrame:
+    """クーポンから、各商品の割引と新しい商品名を決める
+
+    Args:
+        df_necessary (pd.DataFrame): prefix_df で前処理した商品一覧。
+            discount、discount_type、discount_price、new_name の列を追加する
+        item_coupons (pd.DataFrame): item.manageNumber を持つ商品ごとのクーポン
+        common_coupons (pd.DataFrame): 全品に適用できるクーポン
+        when (datetime): この日時に有効なクーポンのみを対象にする
+
+    Returns:
+        pd.DataFrame: 列を追加した df_necessary
+    """
+    bracketed = has_brackets(df_necessary["item.title"])
+    df_necessary[["discount", "discount_type", "discount_price"]] = select_best_coupon(
+        df_necessary[bracketed], item_coupons, common_coupons, when
+    )
+    df_necessary["new_name"] = render_titles(df_necessary)
+    return df_necessary
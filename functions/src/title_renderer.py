@@ -0,0 +1,108 @@
+"""クーポン情報から新しい商品名を作る処理
+
+商品名の決め方を TITLE_RULES の表で定義し、全商品分をまとめて判定する。
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+# 【】があるかないかの判定＝クーポン情報を反映するかどうかの判定
+BRACKETS = re.compile(r"【[^】]*】")
+# 先頭の【】（前回反映したクーポン情報）
+LEADING_BRACKETS = re.compile(r"^【[^】]*】")
+
+# 新しい商品名の決め方。上から順に判定し、最初に当てはまったものを使う
+# (割引タイプ, 条件, 表示する割引後の価格, 末尾に付ける記号)
+# 条件の v は render_titles 内の変数（ratio、discount、sku_number）
+TITLE_RULES = [
+    ## 定額値引きのクーポンが最大割引の場合
+    # 半額以下になる時は、半額で表示
+    ("1", lambda v: v["ratio"] >= 2, "half_price", ""),
+    ("1", None, "discount_price", ""),
+    ## 定率値引きのクーポンが最大割引の場合。割引率とSKUの数で場合分け
+    # 50%を超える割引は、半額で表示
+    ("2", lambda v: (v["discount"] > 50) & (v["sku_number"] > 1), "half_price", "～"),
+    ("2", lambda v: (v["discount"] > 50) & (v["sku_number"] == 1), "half_price", ""),
+    (
+        "2",
+        lambda v: (v["discount"] <= 50) & (v["sku_number"] > 1),
+        "discount_price",
+        "～",
+    ),
+    (
+        "2",
+        lambda v: (v["discount"] <= 50) & (v["sku_number"] == 1),
+        "discount_price",
+        "",
+    ),
+]
+
+
+def has_brackets(titles: pd.Series) -> pd.Series:
+    """【】を含む商品名かどうか"""
+    return titles.str.contains(BRACKETS)
+
+
+def render_titles(df_necessary: pd.DataFrame) -> pd.Series:
+    """新しい商品名を全商品分まとめて作る
+
+    【】のない商品名はそのまま。【】がある商品名は先頭の【】を外し、
+    TITLE_RULES で決めた【クーポンで○円→○円】を付ける。
+    当てはまるルールがない割引タイプ（クーポンなし）は【】を外した商品名のみ
+
+    Args:
+        df_necessary (pd.DataFrame): item.title、price、sku_number、discount、
+            discount_type、discount_price を持つDataFrame
+
+    Returns:
+        pd.Series: df_necessary と同じindexの新しい商品名
+    """
+    titles = df_necessary["item.title"]
+    target = has_brackets(titles).to_numpy(dtype=bool)
+    new_names = titles.to_numpy(dtype=object).copy()
+    if not target.any():
+        return pd.Series(new_names, index=df_necessary.index)
+
+    df_target = df_necessary[target]
+    old_titles = df_target["item.title"].str.replace(LEADING_BRACKETS, "", regex=True)
+    old_price = df_target["price"].to_numpy(dtype="int64")
+    # int()と同じく、小数点以下は0の方向に切り捨て
+    prices = {
+        "discount_price": df_target["discount_price"].to_numpy(dtype="float64"),
+        "half_price": old_price * 0.5,
+    }
+    prices = {key: value.astype("int64") for key, value in prices.items()}
+    discount_type = df_target["discount_type"].to_numpy(dtype=object)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variables = {
+            "ratio": old_price / prices["discount_price"],
+            "discount": df_target["discount"].to_numpy(dtype="float64"),
+            "sku_number": df_target["sku_number"].to_numpy(dtype="float64"),
+        }
+
+    # 上から順に判定して、商品ごとに使うルールの番号を決める（どれでもなければ-1）
+    conditions = []
+    for rule_type, condition, _, _ in TITLE_RULES:
+        matched = discount_type == rule_type
+        if condition is not None:
+            matched = matched & condition(variables)
+        conditions.append(matched)
+    rule_index = np.select(conditions, range(len(TITLE_RULES)), default=-1)
+
+    # 割引タイプが1・2以外は、【】を外した商品名
+    old_titles = old_titles.to_numpy(dtype=object)
+    target_names = old_titles.copy()
+    # 割引タイプ2で、SKUの数が条件に当てはまらない時は商品名を決めない
+    target_names[(discount_type == "1") | (discount_type == "2")] = np.nan
+    for number, (_, _, price_key, suffix) in enumerate(TITLE_RULES):
+        rows = np.flatnonzero(rule_index == number)
+        target_names[rows] = [
+            f"【クーポンで{old:,}円→{new:,}円{suffix}】{rest}"
+            for old, new, rest in zip(
+                old_price[rows], prices[price_key][rows], old_titles[rows]
+            )
+        ]
+    new_names[target] = target_names
+    return pd.Series(new_names, index=df_necessary.index)
@@ -42,9 +42,45 @@ resource "google_cloudfunctions2_function" "function" {
   }
   service_config {
     min_instance_count = 1
+    # チェックポイントとリースは/tmpに置くため、再試行も同じインスタンスで1件ずつ処理する
+    max_instance_count = 1
+    max_instance_request_concurrency = 1
     available_memory   = "256Mi"
     timeout_seconds    = 3600
     service_account_email = google_service_account.account.email
+    # PIPELINE_MODE が sharded の時に、シャードを処理させるワーカー関数
+    environment_variables = {
+      WORKER_URL = google_cloudfunctions2_function.worker.service_config[0].uri
+    }
+  }
+}
+
+# シャードを処理するワーカー関数。同じソースの worker をエントリーポイントにする
+resource "google_cloudfunctions2_function" "worker" {
+    depends_on = [
+    google_storage_bucket_object.source_code,
+  ]
+  name        = "rakuten-scheduled-rename-worker"
+  location    = "us-central1"
+  description = "楽天市場の商品名の変更を、シャードごとに並列に処理する関数"
+  project     = local.project
+
+  build_config {
+    runtime     = "python311"
+    entry_point = "worker"
+    source {
+      storage_source {
+        object  = "terraform-functions"
+        bucket = "terraform-functions-bucket"
+      }
+    }
+  }
+  service_config {
+    available_memory   = "256Mi"
+    timeout_seconds    = 3600
+    # 1シャードを1インスタンスで処理する
+    max_instance_request_concurrency = 1
+    service_account_email = google_service_account.account.email
   }
 }
 
@@ -65,6 +101,15 @@ resource "google_cloud_run_service_iam_member" "cloud_run_invoker" {
   member   = "serviceAccount:${google_service_account.account.email}"
 }
 
+# 関数からワーカー関数を呼び出す権限
+resource "google_cloud_run_service_iam_member" "worker_invoker" {
+  project  = google_cloudfunctions2_function.worker.project
+  location = google_cloudfunctions2_function.worker.location
+  service  = google_cloudfunctions2_function.worker.name
+  role     = "roles/run.invoker"
+  member   = "serviceAccount:${google_service_account.account.email}"
+}
+
 resource "google_cloud_scheduler_job" "invoke_cloud_function" {
   name        = "invoke-rakuten-scheduled-rename"
   description = "Schedule the HTTPS trigger for cloud function"
@@ -72,6 +117,16 @@ resource "google_cloud_scheduler_job" "invoke_cloud_function" {
   project     = google_cloudfunctions2_function.function.project
   region      = google_cloudfunctions2_function.function.location
 
+  # HTTPの応答を待つ上限（最大の30分）。これより長い実行は、待ち切れずに再試行される。
+  # その再試行は関数のリースで弾き（409）、完了した直後の再試行は何もせずに終わる
+  attempt_deadline = "1800s"
+
+  # 失敗した時は、チェックポイントから続きを再開するため再実行する
+  retry_config {
+    retry_count          = 2
+    min_backoff_duration = "60s"
+  }
+
   http_target {
     uri         = google_cloudfunctions2_function.function.service_config[0].uri
     http_method = "POST"